@@ -0,0 +1,557 @@
+"""
+Offline benchmark for the SnapStream download paths.
+
+Starts a local fake CDN (synthetic media files with configurable size,
+latency, per-connection bandwidth, Range support and 429 injection) and a
+fake Coub likes API, then runs every download path against it in its own
+child process and reports items/s, MB/s and peak RSS. The instagram-file
+and playlist scenarios feed 10^5 URL lines / 5*10^4 lazily listed new
+entries (and 4x that) through a stubbed yt-dlp and fail if peak RSS
+grows with the input. Also measures CLI startup relative to a bare interpreter
+and the -X importtime cost of coubyuinst, and checks that neither the
+import nor a coub-likes run loads yt_dlp.
+
+    python benchmark.py
+    python benchmark.py --files 500 --size-kb 512 --latency-ms 20 --inject-429 50
+    python benchmark.py --json new.json --baseline old.json
+
+No network access is needed except for 127.0.0.1.
+"""
+import argparse
+import json
+import os
+import py_compile
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = ("direct", "segmented", "async", "coub-threads", "coub-async", "ytdlp", "batch",
+             "instagram-file", "playlist")
+LINE_SCENARIOS = ("instagram-file", "playlist")  # N ve 4N satırla çalışır; peak RSS sabit kalmalı
+BLOCK = bytes(range(256)) * 256  # 64 KiB desen; dosya içeriği offset'ten hesaplanır
+HEAVY_MODULES = ("yt_dlp", "requests", "aiohttp")
+
+# ----------------- FAKE CDN + COUB API -----------------
+def synthetic_bytes(start, end):
+    """Bytes start..end (inclusive) of every synthetic file."""
+    out = bytearray()
+    pos = start
+    while pos <= end:
+        offset = pos % len(BLOCK)
+        piece = BLOCK[offset:offset + end + 1 - pos]
+        out += piece
+        pos += len(piece)
+    return bytes(out)
+
+def start_fake_server(latency=0.0, bandwidth=0, ranges=True, inject_429=0, likes=0, like_size=0):
+    """
+    Serves /media/<name>-<size>.mp4 and the Coub endpoints used by
+    coubyuinst (/api/v2/timeline/likes, /api/v2/coubs/<id>) on a free port.
+    bandwidth is bytes/s per connection (0 = unlimited); every
+    inject_429-th request answers 429 with Retry-After: 0.
+    Returns (server, base_url).
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    counter = {"requests": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def throttled(self):
+            if not inject_429:
+                return False
+            with lock:
+                counter["requests"] += 1
+                hit = counter["requests"] % inject_429 == 0
+            if hit:
+                self.send_response(429)
+                self.send_header("Retry-After", "0")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+            return hit
+
+        def send_json(self, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def coub(self, coub_id):
+            base = f"http://{self.headers.get('Host')}"
+            return {"id": coub_id, "permalink": f"c{coub_id}", "title": f"coub {coub_id}",
+                    "file_versions": {"share": {"default": f"{base}/media/coub{coub_id}-{like_size}.mp4"}}}
+
+        def do_HEAD(self):
+            self.do_GET(head=True)
+
+        def do_GET(self, head=False):
+            if latency:
+                time.sleep(latency)
+            if self.throttled():
+                return
+            parsed = urllib.parse.urlparse(self.path)
+            if parsed.path == "/api/v2/timeline/likes":
+                qs = urllib.parse.parse_qs(parsed.query)
+                page, per_page = int(qs.get("page", ["1"])[0]), int(qs.get("per_page", ["50"])[0])
+                first = (page - 1) * per_page + 1
+                ids = range(first, min(likes, first + per_page - 1) + 1)
+                return self.send_json({"page": page, "coubs": [self.coub(i) for i in ids]})
+            if parsed.path.startswith("/api/v2/coubs/"):
+                return self.send_json(self.coub(int(parsed.path.rsplit("/", 1)[-1].lstrip("c"))))
+            if not parsed.path.startswith("/media/"):
+                self.send_error(404)
+                return
+            size = int(os.path.splitext(parsed.path)[0].rsplit("-", 1)[-1])
+            start, end = 0, size - 1
+            byte_range = self.headers.get("Range") if ranges else None
+            if byte_range and byte_range.startswith("bytes="):
+                first, _, last = byte_range[6:].partition("-")
+                start, end = int(first or 0), min(int(last) if last else size - 1, size - 1)
+                if start >= size:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{size}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            else:
+                self.send_response(200)
+            self.send_header("Content-Type", "video/mp4")
+            self.send_header("Content-Length", str(end + 1 - start))
+            if ranges:
+                self.send_header("Accept-Ranges", "bytes")
+            self.end_headers()
+            if head:
+                return
+            chunk = 64 * 1024
+            pos = start
+            try:
+                while pos <= end:
+                    data = synthetic_bytes(pos, min(end, pos + chunk - 1))
+                    self.wfile.write(data)
+                    pos += len(data)
+                    if bandwidth:
+                        time.sleep(len(data) / bandwidth)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+
+        def handle_error(self, request, client_address):
+            if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+                super().handle_error(request, client_address)  # istemcinin kapattığı keep-alive bağlantıları sessiz
+
+    server = Server(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, name="fake-cdn", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+# ----------------- SCENARIOS (child process) -----------------
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None  # Windows
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def run_scenario(name, base, opts):
+    """Runs one download path in the current directory; returns its result dict."""
+    sys.path.insert(0, HERE)
+    import coubyuinst
+
+    host = urllib.parse.urlparse(base).netloc
+    rate = opts["rate"] or 1e6
+    coubyuinst.RATE_LIMITS[host] = (rate, rate)
+    coubyuinst.COUB_API_BASE = f"{base}/api/v2"
+    coubyuinst.configure_rate_limits(retries=opts["retries"])
+    coubyuinst.configure_transfer_limits(bandwidth=opts.get("cap") or None)
+    coubyuinst.configure_metrics("metrics.jsonl")
+    size, jobs = opts["size"], opts["jobs"]
+    urls = [f"{base}/media/f{i}-{size}.mp4" for i in range(opts["files"])]
+    expected = len(urls)
+
+    started = time.monotonic()
+    if name == "direct":
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            list(pool.map(lambda i: coubyuinst.download_video(urls[i], "out", f"f{i}"), range(len(urls))))
+    elif name == "segmented":
+        large = opts["large_size"]
+        expected = opts["large_files"]
+        for i in range(expected):
+            coubyuinst.download_video(f"{base}/media/big{i}-{large}.mp4", "out", f"big{i}", segments=opts["segments"],
+                                      segment_threshold=1)
+    elif name == "async":
+        jobs_list = [(url, "out", f"f{i}", None) for i, url in enumerate(urls)]
+        coubyuinst.download_many_async(lambda put: [put(job) for job in jobs_list], jobs=jobs, per_host=jobs)
+    elif name in ("coub-threads", "coub-async"):
+        coubyuinst.download_coub_likes("_coub_session=bench", "bench", jobs=jobs,
+                                       backend="async" if name == "coub-async" else "threads", per_host=jobs)
+    elif name == "batch":
+        with open("manifest.txt", "w", encoding="utf-8") as f:
+            for i in range(1, expected + 1):
+                f.write(f"https://coub.com/view/c{i}\n")
+        coubyuinst.run_batch("manifest.txt", limits={"coub": jobs})
+    elif name in LINE_SCENARIOS:
+        return run_line_scenario(coubyuinst, name, opts)
+    elif name == "ytdlp":
+        import yt_dlp
+        from concurrent.futures import ThreadPoolExecutor
+        local = threading.local()
+        opts_ydl = {"outtmpl": os.path.join("out", "%(id)s.%(ext)s"), "quiet": True, "noprogress": True}
+
+        def fetch(url):
+            if not hasattr(local, "ydl"):
+                local.ydl = yt_dlp.YoutubeDL(opts_ydl)
+            coubyuinst.ytdlp_call("youtube", lambda: local.ydl.extract_info(url, download=True), label=url)
+
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            for future in [pool.submit(fetch, url) for url in urls]:
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Fail: {e}", file=sys.stderr)
+    seconds = time.monotonic() - started
+
+    summary = coubyuinst._metrics.summary()
+    coubyuinst.close_metrics()
+    files = [os.path.join(root, f) for root, _, names in os.walk(".") for f in names
+             if f.endswith(".mp4") and not f.endswith(".part")]
+    total = sum(os.path.getsize(f) for f in files)
+    p95 = (summary["latency"].get("download:done") or {}).get("p95")
+    return {
+        "scenario": name,
+        "items": len(files),
+        "expected": expected,
+        "bytes": total,
+        "seconds": round(seconds, 3),
+        "items_per_s": round(len(files) / seconds, 2) if seconds else 0.0,
+        "mb_per_s": round(total / 1e6 / seconds, 2) if seconds else 0.0,
+        "p95_item_seconds": p95,
+        "retries": summary["counts"].get("retry", 0),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def stub_youtube_dl(entries, write_files=False):
+    """
+    Patches yt_dlp.YoutubeDL so probes answer from memory: a playlist URL
+    lists `entries` (a generator), any other URL resolves to a small info
+    dict, and process_ie_result counts (and with write_files creates an
+    empty output file, like a finished download). Returns the counter.
+    """
+    import itertools
+    import yt_dlp
+    processed = itertools.count()
+
+    class BenchYoutubeDL(yt_dlp.YoutubeDL):
+        def extract_info(self, url, download=True, process=True, **kwargs):
+            if "list=" in url:
+                return {"_type": "playlist", "id": "bench", "title": "bench", "entries": entries}
+            media_id = url.rstrip("/").rsplit("/", 1)[-1].split("=")[-1]
+            return {"id": media_id, "title": f"video {media_id}", "ext": "mp4", "url": url, "webpage_url": url}
+
+        def process_ie_result(self, ie_result, download=True, extra_info=None):
+            next(processed)
+            if write_files:
+                path = self.prepare_filename(ie_result)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                open(path, "wb").close()
+                ie_result["filepath"] = path
+            return ie_result
+
+    yt_dlp.YoutubeDL = BenchYoutubeDL
+    return processed
+
+class PassThroughPostProcessor:
+    """PostProcessQueue stand-in: every file is already in its target format."""
+
+    def submit(self, src, target_format, on_done=None, media=None):
+        from concurrent.futures import Future
+        if on_done is not None:
+            on_done(src)
+        future = Future()
+        future.set_result(src)
+        return future
+
+    def close(self):
+        pass
+
+def run_line_scenario(coubyuinst, name, opts):
+    """
+    Feeds instagram-download --file a URL file, or a playlist download a
+    lazy entries generator, with `lines` x `line_factor` items and no real
+    transfers, so peak RSS shows whether per-item state is held in memory.
+    """
+    for platform in ("instagram", "youtube"):
+        coubyuinst.RATE_LIMITS[platform] = (1e6, 1e6)
+    coubyuinst.configure_rate_limits()
+    lines = opts["entries" if name == "playlist" else "lines"] * opts.get("line_factor", 1)
+    listed = [0]
+
+    def entries():
+        for i in range(1, lines + 1):
+            listed[0] += 1
+            yield {"id": f"v{i:010d}", "url": f"v{i:010d}", "title": f"video {i}"}
+
+    processed = stub_youtube_dl(entries(), write_files=name == "playlist")
+    started = time.monotonic()
+    if name == "instagram-file":
+        with open("urls.txt", "w", encoding="utf-8") as f:
+            for i in range(1, lines + 1):
+                f.write(f"https://www.instagram.com/p/B{i:09d}/\n")
+        started = time.monotonic()
+        coubyuinst.download_instagram_from_file("urls.txt", "out")
+        items = next(processed)
+    else:
+        # boş arşivle ilk senkron: her entry indirilir, çıktı yolu alınır ve arşive yazılır
+        archive = coubyuinst.DownloadArchive("archive.sqlite3")
+        coubyuinst.download_youtube_playlist("https://www.youtube.com/playlist?list=bench", jobs=opts["jobs"],
+                                             archive=archive, postprocessor=PassThroughPostProcessor())
+        items = min(listed[0], next(processed))
+    seconds = time.monotonic() - started
+    summary = coubyuinst._metrics.summary()
+    coubyuinst.close_metrics()
+    return {
+        "scenario": name,
+        "items": items,
+        "expected": lines,
+        "bytes": 0,
+        "seconds": round(seconds, 3),
+        "items_per_s": round(items / seconds, 2) if seconds else 0.0,
+        "mb_per_s": 0.0,
+        "p95_item_seconds": (summary["latency"].get("item:done") or {}).get("p95"),
+        "retries": summary["counts"].get("retry", 0),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def run_child(name, base, opts):
+    """Runs a scenario in a fresh interpreter and temp dir so RSS and imports are per path."""
+    workdir = tempfile.mkdtemp(prefix=f"snapstream-bench-{name}-")
+    try:
+        cmd = [sys.executable, os.path.abspath(__file__), "--child", name, "--base", base, "--child-opts", json.dumps(opts)]
+        result = subprocess.run(cmd, cwd=workdir, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        lines = result.stdout.decode("utf-8", "replace").strip().splitlines()
+        if result.returncode != 0 or not lines:
+            print(result.stderr.decode("utf-8", "replace")[-2000:], file=sys.stderr)
+            return {"scenario": name, "error": f"exit {result.returncode}"}
+        return json.loads(lines[-1])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+# ----------------- STARTUP -----------------
+def time_command(cmd, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.monotonic()
+        subprocess.run(cmd, cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        timings.append(time.monotonic() - started)
+    return statistics.median(timings)
+
+def import_seconds(module, repeat):
+    """Median cumulative `-X importtime` of module: its own import cost without interpreter startup."""
+    timings = []
+    for _ in range(repeat):
+        err = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=HERE,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True).stderr
+        for line in err.decode("utf-8", "replace").splitlines():
+            fields = [f.strip() for f in line.split("|")]
+            if len(fields) == 3 and fields[2] == module:
+                timings.append(int(fields[1]) / 1e6)
+    return statistics.median(timings) if timings else None
+
+def measure_startup(base, repeat=5):
+    """
+    `--help` time against a bare interpreter, the -X importtime cost of
+    coubyuinst, heavy modules loaded by the import, and a coub-likes run
+    (one page from the fake API) that must not load yt_dlp.
+    """
+    script = os.path.join(HERE, "coubyuinst.py")
+    # PYTHONDONTWRITEBYTECODE / bayat .pyc ile import süresi derlemeyi de içerirdi; önce derlenir
+    py_compile.compile(script)
+    probe = ("import json, sys; sys.path.insert(0, %r); import coubyuinst; "
+             "print(json.dumps([m for m in %r if m in sys.modules]))" % (HERE, HEAVY_MODULES))
+    loaded = subprocess.run([sys.executable, "-c", probe], cwd=HERE, stdout=subprocess.PIPE, check=True).stdout
+    result = {
+        "scenario": "startup",
+        "help_seconds": round(time_command([sys.executable, script, "--help"], repeat), 3),
+        "python_seconds": round(time_command([sys.executable, "-c", "pass"], repeat), 3),
+        "import_seconds": import_seconds("coubyuinst", repeat),
+        "heavy_modules_on_import": json.loads(loaded),
+    }
+    try:
+        result["yt_dlp_import_seconds"] = import_seconds("yt_dlp", 1)
+    except subprocess.CalledProcessError:
+        result["yt_dlp_import_seconds"] = None
+    # coub-likes yalnızca requests kullanır; yt_dlp yüklenirse lazy import bozulmuş demektir
+    coub_probe = ("import json, sys, time, urllib.parse; sys.path.insert(0, %r); started = time.monotonic(); "
+                  "import coubyuinst; base = %r; coubyuinst.COUB_API_BASE = base + '/api/v2'; "
+                  "coubyuinst.RATE_LIMITS[urllib.parse.urlparse(base).netloc] = (1e6, 1e6); "
+                  "sys.stdout = open(%r, 'w'); coubyuinst.download_coub_likes('s', 't', jobs=1); "
+                  "sys.stdout = sys.__stdout__; "
+                  "print(json.dumps([round(time.monotonic() - started, 3), [m for m in %r if m in sys.modules]]))"
+                  % (HERE, base, os.devnull, HEAVY_MODULES))
+    workdir = tempfile.mkdtemp(prefix="snapstream-bench-startup-")
+    try:
+        out = subprocess.run([sys.executable, "-c", coub_probe], cwd=workdir, stdout=subprocess.PIPE, check=True).stdout
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    result["coub_likes_seconds"], coub_modules = json.loads(out.decode("utf-8").strip().splitlines()[-1])
+    result["coub_likes_loads_yt_dlp"] = "yt_dlp" in coub_modules
+    return result
+
+# ----------------- REPORT -----------------
+def print_report(results):
+    print(f"{'scenario':<18}{'items':>16}{'seconds':>10}{'items/s':>10}{'MB/s':>10}{'p95 s':>8}{'retries':>9}{'RSS MB':>9}")
+    for r in results:
+        if r["scenario"] == "startup":
+            continue
+        if "error" in r:
+            print(f"{r['scenario']:<18}  {r['error']}")
+            continue
+        items = f"{r['items']}/{r['expected']}"
+        p95 = "-" if r["p95_item_seconds"] is None else f"{r['p95_item_seconds']:.2f}"
+        rss = "-" if r["peak_rss_mb"] is None else f"{r['peak_rss_mb']:.0f}"
+        print(f"{r['scenario']:<18}{items:>16}{r['seconds']:>10.2f}{r['items_per_s']:>10.1f}{r['mb_per_s']:>10.1f}"
+              f"{p95:>8}{r['retries']:>9}{rss:>9}")
+    for r in results:
+        if r["scenario"] == "startup":
+            print(f"startup: --help {r['help_seconds']:.3f}s (bare python {r['python_seconds']:.3f}s), "
+                  f"import coubyuinst {r['import_seconds']}s (import yt_dlp {r['yt_dlp_import_seconds']}s); "
+                  f"heavy modules on import: {', '.join(r['heavy_modules_on_import']) or 'none'}; "
+                  f"coub-likes run {r['coub_likes_seconds']:.3f}s, "
+                  f"{'loads' if r['coub_likes_loads_yt_dlp'] else 'does not load'} yt_dlp")
+
+def check(results, startup_budget, baseline=None, tolerance=0.2, rss_growth=0.25, import_budget=0.05):
+    """Problems found: incomplete scenarios, slow startup, throughput below baseline, RSS growing with input."""
+    problems = []
+    previous = {r["scenario"]: r for r in baseline or []}
+    current = {r["scenario"]: r for r in results if "error" not in r}
+    for name in LINE_SCENARIOS:
+        small, large = current.get(name), current.get(f"{name}-4x")
+        if small and large and small["peak_rss_mb"] and large["peak_rss_mb"] > small["peak_rss_mb"] * (1 + rss_growth):
+            problems.append(f"{name}: peak RSS {small['peak_rss_mb']} MB -> {large['peak_rss_mb']} MB with 4x the input")
+    for r in results:
+        if "error" in r:
+            problems.append(f"{r['scenario']}: {r['error']}")
+        elif r["scenario"] == "startup":
+            if r["heavy_modules_on_import"]:
+                problems.append(f"startup: importing coubyuinst loads {', '.join(r['heavy_modules_on_import'])}")
+            overhead = r["help_seconds"] - r["python_seconds"]
+            if overhead > startup_budget:
+                problems.append(f"startup: --help took {overhead:.3f}s beyond bare python (budget {startup_budget:.3f}s)")
+            if r["import_seconds"] is not None and r["import_seconds"] > import_budget:
+                problems.append(f"startup: import coubyuinst took {r['import_seconds']:.3f}s (budget {import_budget:.3f}s)")
+            if r["coub_likes_loads_yt_dlp"]:
+                problems.append("startup: coub-likes loads yt_dlp")
+        else:
+            if r["items"] < r["expected"]:
+                problems.append(f"{r['scenario']}: {r['items']}/{r['expected']} items downloaded")
+            old = previous.get(r["scenario"])
+            if old and old.get("items_per_s") and r["items_per_s"] < old["items_per_s"] * (1 - tolerance):
+                problems.append(f"{r['scenario']}: {r['items_per_s']} items/s, baseline {old['items_per_s']}")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark for SnapStream download paths")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS + ("startup",)),
+                        help="comma separated subset of: " + ", ".join(SCENARIOS + ("startup",)))
+    parser.add_argument("--files", type=int, default=200, help="files per scenario (default 200)")
+    parser.add_argument("--lines", type=int, default=100000, help="instagram-file scenario: URL lines (default 100000)")
+    parser.add_argument("--entries", type=int, default=50000,
+                        help="playlist scenario: entries, all new and downloaded (default 50000)")
+    parser.add_argument("--size-kb", type=int, default=256, help="size of each file in KiB (default 256)")
+    parser.add_argument("--large-files", type=int, default=2, help="segmented scenario: number of large files (default 2)")
+    parser.add_argument("--large-mb", type=int, default=32, help="segmented scenario: size of each large file in MiB (default 32)")
+    parser.add_argument("--segments", type=int, default=4, help="segmented scenario: range requests per file (default 4)")
+    parser.add_argument("--jobs", type=int, default=8, help="concurrent transfers per scenario (default 8)")
+    parser.add_argument("--latency-ms", type=float, default=5, help="delay before every response (default 5)")
+    parser.add_argument("--bandwidth-kb", type=int, default=0, help="per-connection cap in KiB/s (default 0 = unlimited)")
+    parser.add_argument("--no-ranges", action="store_true", help="serve without Range support")
+    parser.add_argument("--inject-429", type=int, default=0, metavar="N", help="answer every Nth request with 429")
+    parser.add_argument("--rate", type=float, default=0, help="client request rate limit (default 0 = unlimited)")
+    parser.add_argument("--retries", type=int, default=5, help="client retries (default 5)")
+    parser.add_argument("--cap-kb", type=int, default=0, help="client --bandwidth cap in KiB/s for all transfers (default 0 = off)")
+    parser.add_argument("--startup-budget", type=float, default=0.1,
+                        help="max seconds `coubyuinst.py --help` may take beyond a bare interpreter (default 0.1)")
+    parser.add_argument("--import-budget", type=float, default=0.05,
+                        help="max cumulative -X importtime seconds of `import coubyuinst` (default 0.05)")
+    parser.add_argument("--rss-growth", type=float, default=0.25,
+                        help="allowed peak RSS growth of the 4x line scenarios over N lines (default 0.25)")
+    parser.add_argument("--json", metavar="FILE", help="write the results to FILE")
+    parser.add_argument("--baseline", metavar="FILE", help="fail when items/s drops below a previous --json run")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed items/s drop against --baseline (default 0.2)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--base", help=argparse.SUPPRESS)
+    parser.add_argument("--child-opts", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        with open(os.devnull, "w") as devnull:
+            # coubyuinst'in ilerleme çıktısı gizlenir; stdout'un son satırı sonuçtur
+            real_stdout, sys.stdout = sys.stdout, devnull
+            try:
+                result = run_scenario(args.child, args.base, json.loads(args.child_opts))
+            finally:
+                sys.stdout = real_stdout
+        print(json.dumps(result))
+        return 0
+
+    names = [n.strip() for n in args.scenarios.split(",") if n.strip()]
+    unknown = [n for n in names if n not in SCENARIOS + ("startup",)]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+    opts = {
+        "files": args.files, "size": args.size_kb * 1024, "jobs": args.jobs, "rate": args.rate,
+        "retries": args.retries, "large_files": args.large_files, "large_size": args.large_mb * 1024 * 1024,
+        "segments": args.segments, "cap": args.cap_kb * 1024, "lines": args.lines,
+        "entries": args.entries,
+    }
+    server, base = start_fake_server(latency=args.latency_ms / 1000, bandwidth=args.bandwidth_kb * 1024,
+                                     ranges=not args.no_ranges, inject_429=args.inject_429,
+                                     likes=args.files, like_size=opts["size"])
+    print(f"Fake CDN + Coub API on {base}: {args.files} x {args.size_kb} KiB, latency {args.latency_ms} ms, "
+          f"bandwidth {args.bandwidth_kb or 'unlimited'} KiB/s, 429 every {args.inject_429 or '-'} requests")
+    results = []
+    try:
+        for name in names:
+            print(f"running {name}...", flush=True)
+            results.append(measure_startup(base) if name == "startup" else run_child(name, base, opts))
+            if name in LINE_SCENARIOS:
+                # aynı senaryo 4 kat girdiyle; bellek sabit kalmalı
+                large = run_child(name, base, dict(opts, line_factor=4))
+                large["scenario"] = f"{name}-4x"
+                results.append(large)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    problems = check(results, args.startup_budget, baseline, args.tolerance, args.rss_growth, args.import_budget)
+    for problem in problems:
+        print("FAIL:", problem)
+    return 1 if problems else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,97 +1,1851 @@
 import os
-import requests
 import argparse
+import contextvars
 import subprocess
+import hashlib
+import json
+import random
 import re
+import shutil
 import urllib.parse
+import threading
 import time
-import yt_dlp
 
-def download_video(video_url, folder, title, file_format="mp4"):
-    os.makedirs(folder, exist_ok=True)
-    filename = os.path.join(folder, f"{title}.{file_format}")
+# requests ve yt_dlp ağır modüller; yalnızca ihtiyaç duyan fonksiyonlar içinde import edilir,
+# böylece --help ve Coub komutları yt_dlp yüklemeden başlar
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024  # 4 MiB
+DEFAULT_SEGMENT_THRESHOLD = 16 * 1024 * 1024  # files smaller than this are never split
+DEFAULT_RETRIES = 3
+
+# ----------------- OUTPUT -----------------
+# print() mesajı ve satır sonunu ayrı yazar; paralel worker'ların satırları tek kilitle sıralanır
+log_lock = threading.Lock()
+
+def log(message):
+    """print() for code that runs on worker threads: whole lines, never interleaved."""
+    with log_lock:
+        print(message)
+
+# ----------------- HTTP -----------------
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def get_http_session():
+    """
+    Returns the process-wide requests.Session. Connections are kept alive and
+    pooled, so consecutive files from the same CDN skip the TCP+TLS handshake.
+    """
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http_session = session
+        return _http_session
+
+# ----------------- METRICS -----------------
+class LatencyHistogram:
+    """
+    Durations in fixed logarithmic buckets (16 per doubling from 1 ms, so
+    percentiles are within ~4%), with exact count and max. Memory does not
+    grow with the number of samples.
+    """
+
+    FLOOR = 0.001
+    PER_DOUBLING = 16
+
+    def __init__(self):
+        self.count = 0
+        self.max = 0.0
+        self._buckets = {}  # kova indeksi -> adet
+
+    def add(self, seconds):
+        import math
+        index = 0 if seconds <= self.FLOOR else 1 + int(math.log2(seconds / self.FLOOR) * self.PER_DOUBLING)
+        self._buckets[index] = self._buckets.get(index, 0) + 1
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile (at most max)."""
+        import math
+        rank, seen = max(1, math.ceil(p / 100 * self.count)), 0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen >= rank:
+                return min(self.FLOOR * 2 ** (index / self.PER_DOUBLING), self.max)
+        return self.max
+
+class Metrics:
+    """
+    Structured event stream: one JSON object per line with "ts", "event"
+    and the event's fields. Events with "seconds" feed a bounded latency
+    histogram of their kind (and status) for the end-of-run p50/p95;
+    "download" events also feed the byte totals. Without a path every
+    event is discarded.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._fh = open(path, "a", encoding="utf-8") if path else None
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._seconds = {}  # "olay:durum" -> LatencyHistogram
+        self._counts = {}   # "olay:durum" -> adet
+        self._bytes = 0
+        self._transfer_seconds = 0.0
+
+    def emit(self, event, **fields):
+        if self._fh is None:
+            return
+        line = json.dumps({"ts": round(time.time(), 3), "event": event, **fields}, default=str)
+        with self._lock:
+            if self._fh is None:
+                return
+            self._fh.write(line + "\n")
+            key = f"{event}:{fields['status']}" if "status" in fields else event
+            self._counts[key] = self._counts.get(key, 0) + 1
+            if fields.get("seconds") is not None:
+                self._seconds.setdefault(key, LatencyHistogram()).add(fields["seconds"])
+            if event == "download" and fields.get("bytes"):
+                self._bytes += fields["bytes"]
+                self._transfer_seconds += fields.get("seconds") or 0.0
+
+    def summary(self):
+        """Counts, p50/p95/max seconds per event kind and aggregate MB/s since start."""
+        with self._lock:
+            wall = time.monotonic() - self._started
+            latency = {}
+            for key, histogram in self._seconds.items():
+                latency[key] = {"count": histogram.count, "p50": round(histogram.percentile(50), 3),
+                                "p95": round(histogram.percentile(95), 3), "max": round(histogram.max, 3)}
+            return {
+                "wall_seconds": round(wall, 3),
+                "bytes": self._bytes,
+                "mb_per_s": round(self._bytes / 1e6 / wall, 3) if wall else 0.0,
+                "transfer_mb_per_s": round(self._bytes / 1e6 / self._transfer_seconds, 3) if self._transfer_seconds else 0.0,
+                "counts": dict(self._counts),
+                "latency": latency,
+            }
+
+    def close(self):
+        """Writes the summary event and closes the file."""
+        if self._fh is None:
+            return
+        summary = self.summary()
+        self.emit("summary", **summary)
+        with self._lock:
+            self._fh.close()
+            self._fh = None
+        print(f"Metrics: {summary['bytes'] / 1e6:.1f} MB in {summary['wall_seconds']:.1f}s "
+              f"({summary['mb_per_s']:.2f} MB/s), written to {self.path}")
+
+_metrics = Metrics()
+# thread'lerde ve asyncio task'larında ayrı sayılır; bir öğenin kaç retry yediğini ölçmek için
+_retry_count = contextvars.ContextVar("snapstream_retry_count", default=0)
+
+def configure_metrics(path=None):
+    """Starts writing metric events to path (JSON lines, appended)."""
+    global _metrics
+    _metrics.close()
+    _metrics = Metrics(path)
+
+def close_metrics():
+    _metrics.close()
+
+def emit_metric(event, **fields):
+    _metrics.emit(event, **fields)
+
+def retry_count():
+    """Retries made so far by the calling thread or task."""
+    return _retry_count.get()
+
+def count_retry(label, attempt, delay, error):
+    _retry_count.set(_retry_count.get() + 1)
+    emit_metric("retry", label=label, attempt=attempt, delay=round(delay, 3), error=str(error)[:200])
+
+def emit_download(platform, media_id, path, seconds, nbytes, retries, status="done", **fields):
+    """One "download" event: a finished, skipped or failed file transfer."""
+    mb_per_s = round(nbytes / 1e6 / seconds, 3) if nbytes and seconds else None
+    emit_metric("download", platform=platform, id=media_id, path=path, status=status, bytes=nbytes,
+                seconds=round(seconds, 3), mb_per_s=mb_per_s, retries=retries, **fields)
+
+def file_size(path):
+    return os.path.getsize(path) if path and os.path.isfile(path) else None
+
+# ----------------- RATE LIMITING -----------------
+# platform adı ya da host son eki -> (başlangıç req/s, üst sınır req/s)
+RATE_LIMITS = {
+    "coub.com": (4.0, 20.0),
+    "coubcdn.com": (10.0, 50.0),
+    "instagram": (1.0, 4.0),
+    "youtube": (2.0, 10.0),
+}
+DEFAULT_RATE_LIMIT = (10.0, 50.0)
+
+class RetryableError(Exception):
+    """A transient failure: throttling, 5xx or a dropped connection."""
+
+    def __init__(self, message, retry_after=None, throttled=False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.throttled = throttled
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled at `rate` tokens per second. A request
+    larger than the bucket is allowed to go into debt, so callers simply wait
+    longer instead of blocking forever.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity is not None else max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, tokens=1):
+        """Takes the tokens and returns how many seconds the caller must wait."""
+        with self._lock:
+            self._refill()
+            self._tokens -= tokens
+            return -self._tokens / self.rate if self._tokens < 0 else 0
+
+    def acquire(self, tokens=1):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+class RateLimiter(TokenBucket):
+    """
+    Per-host request limiter. The rate climbs towards max_rate while requests
+    succeed and is halved whenever the host throttles us; a Retry-After value
+    pauses every worker talking to that host, not just the one that got it.
+    """
+
+    def __init__(self, rate, max_rate=None, min_rate=0.05):
+        super().__init__(rate)
+        self.max_rate = float(max_rate) if max_rate is not None else self.rate
+        self.min_rate = min_rate
+
+    def success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+            self.capacity = max(1.0, self.rate)
+
+    def throttled(self, retry_after=None):
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.capacity = max(1.0, self.rate)
+            if retry_after:
+                self._tokens = min(self._tokens, -retry_after * self.rate)
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+_retries = DEFAULT_RETRIES
+
+def configure_rate_limits(rates=None, retries=None):
+    """Applies --rate KEY=REQ_PER_S overrides (as a ceiling) and --retries."""
+    global _retries
+    for key, value in (rates or {}).items():
+        start, _ = RATE_LIMITS.get(key, DEFAULT_RATE_LIMIT)
+        RATE_LIMITS[key] = (min(start, value), value)
+    if retries is not None:
+        _retries = max(0, retries)
+    with _rate_limiters_lock:
+        _rate_limiters.clear()
+
+def get_rate_limiter(key):
+    """Shared limiter for a platform name ("instagram") or a host name."""
+    key = key.lower()
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(key)
+        if limiter is None:
+            limits = DEFAULT_RATE_LIMIT
+            for suffix, value in RATE_LIMITS.items():
+                if key == suffix or key.endswith("." + suffix):
+                    limits = value
+                    break
+            limiter = _rate_limiters[key] = RateLimiter(*limits)
+        return limiter
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value.strip())
+    try:
+        from email.utils import parsedate_to_datetime
+        from datetime import datetime, timezone
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, retry_after=None, base=1.0, cap=60.0):
+    """Exponential backoff with full jitter; Retry-After wins when given."""
+    if retry_after is not None:
+        return min(retry_after, cap * 5)
+    return random.uniform(0, min(cap, base * 2 ** attempt)) + base / 2
+
+def with_retries(fn, limiter, retries=None, label=""):
+    """
+    Calls fn() behind the limiter, retrying RetryableError with backoff.
+    The last RetryableError is re-raised once retries are used up.
+    """
+    retries = _retries if retries is None else retries
+    for attempt in range(retries + 1):
+        limiter.acquire()
+        try:
+            result = fn()
+        except RetryableError as e:
+            if e.throttled:
+                limiter.throttled(e.retry_after)
+            if attempt >= retries:
+                raise
+            delay = backoff_delay(attempt, e.retry_after)
+            log(f"Retry {attempt + 1}/{retries} in {delay:.1f}s ({label}): {e}")
+            count_retry(label, attempt + 1, delay, e)
+            time.sleep(delay)
+        else:
+            limiter.success()
+            return result
+
+def http_get(url, retries=None, **kwargs):
+    """Rate-limited GET through the shared session; 429/5xx/connection errors are retried."""
+    return http_request("GET", url, retries=retries, **kwargs)
+
+def http_request(method, url, retries=None, **kwargs):
+    import requests
+    kwargs.setdefault("timeout", (10, 60))
+
+    def attempt():
+        try:
+            r = get_http_session().request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise RetryableError(str(e))
+        if r.status_code == 429 or r.status_code in (500, 502, 503, 504):
+            retry_after = parse_retry_after(r.headers.get("Retry-After"))
+            r.close()
+            raise RetryableError(f"HTTP {r.status_code}", retry_after=retry_after,
+                                 throttled=r.status_code in (429, 503))
+        return r
+
+    return with_retries(attempt, get_rate_limiter(urllib.parse.urlparse(url).netloc), retries, label=url)
+
+YTDLP_TRANSIENT_MARKERS = ("HTTP Error 429", "Too Many Requests", "rate-limit reached",
+                           "HTTP Error 5", "timed out", "Connection reset", "Remote end closed")
+
+def ytdlp_call(platform, fn, label=""):
+    """Runs a yt-dlp extract/download call behind the platform limiter with retries."""
+    def attempt():
+        try:
+            return fn()
+        except Exception as e:
+            message = str(e)
+            if any(marker in message for marker in YTDLP_TRANSIENT_MARKERS):
+                throttled = "429" in message or "Too Many" in message or "rate-limit" in message
+                raise RetryableError(message, throttled=throttled) from e
+            raise
+
+    try:
+        return with_retries(attempt, get_rate_limiter(platform), label=label)
+    finally:
+        release_ytdlp_reservation()
+
+# ----------------- BANDWIDTH & DISK -----------------
+DEFAULT_MIN_FREE = 512 * 1024 * 1024  # indirmeler diskte en az bu kadar boş yer bırakır
+DISK_WAIT_POLL = 2.0
+
+_bandwidth = None  # tüm transferlerin paylaştığı TokenBucket (byte/s); None = sınırsız
+_ytdlp_tickets = threading.local()
+
+class DiskSpaceError(Exception):
+    """A download does not fit on the disk even with nothing else in flight."""
+
+class DiskGuard:
+    """
+    Admission control for downloads. A file of `expected` bytes starts only
+    if the free space, minus what in-flight downloads on the same disk still
+    have to write, stays above `min_free`; otherwise the worker waits for
+    the running downloads to finish. When nothing else is running and the
+    file still does not fit, DiskSpaceError is raised and the item fails.
+    """
+
+    def __init__(self, min_free=DEFAULT_MIN_FREE, poll=DISK_WAIT_POLL):
+        self.min_free = min_free
+        self.poll = poll
+        self.waits = 0
+        self._inflight = {}  # ticket -> (st_dev, expected bytes, .part path or None)
+        self._cond = threading.Condition()
+
+    @staticmethod
+    def _remaining(expected, path):
+        # .part'ı bilinen indirmelerin diske yazılmış kısmı zaten "used" içinde
+        return max(0, expected - (file_size(path) or 0)) if path else expected
+
+    def try_admit(self, folder, expected=0, path=None):
+        """Ticket when the file fits now, None when it has to wait; DiskSpaceError when it never will."""
+        folder = _existing_dir(folder)
+        free = shutil.disk_usage(folder).free
+        device = os.stat(folder).st_dev
+        expected = expected or 0
+        with self._cond:
+            others = [(e, p) for dev, e, p in self._inflight.values() if dev == device]
+            need = sum(self._remaining(e, p) for e, p in others) + self._remaining(expected, path) + self.min_free
+            if free >= need:
+                ticket = object()
+                self._inflight[ticket] = (device, expected, path)
+                return ticket
+        if not others:
+            raise DiskSpaceError(f"not enough disk space in {folder}: {free / 2**20:.1f} MiB free, "
+                                 f"{expected / 2**20:.1f} MiB needed + {self.min_free / 2**20:.1f} MiB reserve")
+        return None
+
+    def _waiting(self, folder, expected):
+        self.waits += 1
+        log(f"Disk almost full, waiting for running downloads ({folder}, {expected / 2**20:.1f} MiB needed)")
+        emit_metric("disk_wait", folder=folder, expected=expected)
+
+    def admit(self, folder, expected=0, path=None):
+        """Blocks until the download fits; returns the ticket for release()."""
+        waited = False
+        while True:
+            ticket = self.try_admit(folder, expected, path)
+            if ticket is not None:
+                return ticket
+            if not waited:
+                self._waiting(folder, expected)
+                waited = True
+            with self._cond:
+                self._cond.wait(self.poll)
+
+    async def admit_async(self, folder, expected=0, path=None):
+        """admit() for the asyncio engine; polls instead of blocking the event loop."""
+        import asyncio
+        waited = False
+        while True:
+            ticket = self.try_admit(folder, expected, path)
+            if ticket is not None:
+                return ticket
+            if not waited:
+                self._waiting(folder, expected)
+                waited = True
+            await asyncio.sleep(self.poll)
+
+    def release(self, ticket):
+        if ticket is None:
+            return
+        with self._cond:
+            self._inflight.pop(ticket, None)
+            self._cond.notify_all()
+
+_disk_guard = DiskGuard()
+
+def _existing_dir(path):
+    """Nearest existing directory at or above path (output folders may not exist yet)."""
+    path = os.path.abspath(path or ".")
+    while not os.path.isdir(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return path
+
+def parse_size(text):
+    """'512K', '20M', '1.5G' (binary units, optional B) or a plain byte count -> bytes."""
+    text = str(text).strip().upper()
+    if text.endswith("B"):
+        text = text[:-1]
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    factor = units.get(text[-1:], 1)
+    return int(float(text[:-1] if text[-1:] in units else text) * factor)
+
+def configure_transfer_limits(bandwidth=None, min_free=None):
+    """Applies --bandwidth (bytes/s for all transfers together; 0/None = unlimited) and --min-free."""
+    global _bandwidth
+    _bandwidth = TokenBucket(bandwidth) if bandwidth else None
+    if min_free is not None:
+        _disk_guard.min_free = max(0, min_free)
+
+def throttle_bandwidth(nbytes):
+    """Blocks until nbytes fit in the global bandwidth budget."""
+    bucket = _bandwidth
+    if bucket is not None:
+        bucket.acquire(nbytes)
+
+async def throttle_bandwidth_async(nbytes):
+    bucket = _bandwidth
+    if bucket is not None:
+        import asyncio
+        wait = bucket.reserve(nbytes)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+def shaped_chunk_size(chunk_size):
+    """Read size under a bandwidth cap: about 1/8 s of budget, so capped transfers interleave smoothly."""
+    bucket = _bandwidth
+    if bucket is None:
+        return chunk_size
+    return max(64 * 1024, min(chunk_size, int(bucket.rate / 8)))
+
+def expected_filesize(info):
+    """Bytes yt-dlp is about to write for info (every selected format); 0 when unknown."""
+    formats = info.get("requested_formats") or [info]
+    return sum(f.get("filesize") or f.get("filesize_approx") or 0 for f in formats)
+
+def ytdlp_transfer_opts(folder):
+    """
+    yt-dlp options that put its downloads under the same limits as ours: a
+    progress hook charges every downloaded byte to the bandwidth budget,
+    and match_filter (called after format selection, before the download)
+    takes a disk reservation of the expected size. The reservation is held
+    per thread until the next item or the end of the ytdlp_call.
+    """
+    seen = {}
+    lock = threading.Lock()
+
+    def progress(d):
+        key = d.get("tmpfilename") or d.get("filename")
+        with lock:
+            if d.get("status") != "downloading":
+                seen.pop(key, None)
+                return
+            done = d.get("downloaded_bytes") or 0
+            # ilk raporda .part'tan devam edilen baytlar sayılmaz
+            delta = done - seen.get(key, done)
+            seen[key] = done
+        if delta > 0:
+            throttle_bandwidth(delta)
+
+    def admit(info, incomplete=False):
+        if not incomplete:
+            release_ytdlp_reservation()  # bu thread'deki önceki dosya bitti
+            _ytdlp_tickets.ticket = _disk_guard.admit(folder, expected_filesize(info))
+        return None
+
+    return {"progress_hooks": [progress], "match_filter": admit}
+
+def release_ytdlp_reservation():
+    """Frees the disk reservation of the last yt-dlp download on this thread."""
+    ticket = getattr(_ytdlp_tickets, "ticket", None)
+    _ytdlp_tickets.ticket = None
+    _disk_guard.release(ticket)
+
+# ----------------- ARCHIVE -----------------
+DEFAULT_ARCHIVE = "snapstream-archive.sqlite3"
+
+class DownloadArchive:
+    """
+    On-disk index of finished downloads keyed by (platform, media_id).
+    Every command looks items up here before probing or extracting them.
+    Safe to share between worker threads.
+    """
+
+    def __init__(self, path=DEFAULT_ARCHIVE):
+        import sqlite3
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS downloads ("
+                " platform TEXT NOT NULL,"
+                " media_id TEXT NOT NULL,"
+                " path TEXT,"
+                " size INTEGER,"
+                " content_hash TEXT,"
+                " downloaded_at REAL NOT NULL,"
+                " PRIMARY KEY (platform, media_id))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS downloads_content_hash ON downloads (content_hash)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS downloads_path ON downloads (path)")
+
+    def has(self, platform, media_id):
+        if not media_id:
+            return False
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM downloads WHERE platform = ? AND media_id = ?",
+                (platform, str(media_id)),
+            ).fetchone()
+        return row is not None
+
+    def add(self, platform, media_id, path=None, content_hash=None):
+        if not media_id:
+            return
+        size = os.path.getsize(path) if path and os.path.isfile(path) else None
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO downloads (platform, media_id, path, size, content_hash, downloaded_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (platform, str(media_id), path, size, content_hash, time.time()),
+            )
+
+    def find_hash(self, content_hash, size=None):
+        """Path of an archived file with this content hash that still exists on disk, or None."""
+        if not content_hash:
+            return None
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path FROM downloads WHERE content_hash = ? AND path IS NOT NULL", (content_hash,),
+            ).fetchall()
+        for (path,) in rows:
+            if os.path.isfile(path) and (size is None or os.path.getsize(path) == size):
+                return path
+        return None
+
+    def owner(self, path):
+        """(platform, media_id) archived under path, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT platform, media_id FROM downloads WHERE path = ? LIMIT 1", (path,),
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def youtube_video_id(url):
+    """Video id from a watch/shorts/youtu.be URL, without any network request."""
+    parsed = urllib.parse.urlparse(url)
+    if parsed.netloc.endswith("youtu.be"):
+        return parsed.path.strip("/").split("/")[0] or None
+    qs = urllib.parse.parse_qs(parsed.query)
+    if 'v' in qs:
+        return qs['v'][0]
+    m = re.match(r'/(?:shorts|embed|live)/([A-Za-z0-9_-]{11})', parsed.path)
+    return m.group(1) if m else None
+
+def instagram_shortcode(url):
+    """Post shortcode from a /p/, /reel/ or /tv/ URL, without any network request."""
+    m = re.search(r'instagram\.com/(?:[^/]+/)?(?:p|reels?|tv)/([A-Za-z0-9_-]+)', url)
+    return m.group(1) if m else None
+
+def downloaded_filepath(info):
+    """Final path of a file yt-dlp downloaded (after postprocessing), if known."""
+    if not isinstance(info, dict):
+        return None
+    for d in info.get('requested_downloads') or []:
+        if d.get('filepath'):
+            return d['filepath']
+    return info.get('filepath') or info.get('_filename')
+
+# ----------------- JOB STATE -----------------
+class JobState:
+    """
+    JSON checkpoint of a batch run (playlist, URL file or Coub crawl): the
+    extracted entry list, a page cursor and per-item status. With --resume
+    the next run picks it up and goes straight to the pending items.
+    Writes are atomic and throttled to one per `save_interval` seconds.
+
+    With sequential=True the keys are 1-based positions (line or playlist
+    index) and every position has to be marked. Positions finished in
+    order fold into a `done_through` watermark. Only failed items and the
+    few finished ahead of it stay in `items`, so the checkpoint stays
+    small for multi-million-line inputs.
+    """
+
+    DONE = ("done", "skipped")
+
+    def __init__(self, path, kind, source, save_interval=1.0, sequential=False):
+        self.path = path
+        self.save_interval = save_interval
+        self.sequential = sequential
+        self.data = {"kind": kind, "source": source, "entries": None, "cursor": None, "items": {}, "done_through": 0}
+        self._lock = threading.Lock()
+        self._saved_at = 0.0
+
+    @classmethod
+    def open(cls, folder, kind, source, resume=False, sequential=False):
+        """State for (kind, source) in folder; loaded only when resuming."""
+        digest = hashlib.sha1(f"{kind}:{source}".encode("utf-8")).hexdigest()[:12]
+        state = cls(os.path.join(folder, f".snapstream-job-{kind}-{digest}.json"), kind, source,
+                    sequential=sequential)
+        if resume and os.path.exists(state.path):
+            try:
+                with open(state.path, "r", encoding="utf-8") as f:
+                    state.data.update(json.load(f))
+                done = sum(1 for v in state.data["items"].values() if v in cls.DONE)
+                failed = sum(1 for v in state.data["items"].values() if v not in cls.DONE)
+                done += state.data.get("done_through", 0) - failed if sequential else 0
+                print(f"Resuming job: {done} item(s) already done ({state.path})")
+            except (OSError, ValueError) as e:
+                print(f"Job state unreadable, starting over: {e}")
+        return state
+
+    @property
+    def entries(self):
+        return self.data.get("entries")
+
+    @entries.setter
+    def entries(self, entries):
+        self.data["entries"] = entries
+        self.save(force=True)
+
+    @property
+    def cursor(self):
+        return self.data.get("cursor")
+
+    @cursor.setter
+    def cursor(self, value):
+        with self._lock:
+            self.data["cursor"] = value
+        self.save()
+
+    @property
+    def listing_error(self):
+        """Why the listing stopped before its end (None when it completed)."""
+        return self.data.get("listing_error")
+
+    @listing_error.setter
+    def listing_error(self, error):
+        with self._lock:
+            self.data["listing_error"] = str(error) if error else None
+        self.save(force=True)
+
+    def restart(self):
+        """Forgets per-item progress whose keys no longer match the input (a re-listed playlist)."""
+        with self._lock:
+            self.data.update(items={}, done_through=0, entries=None, listing=None)
+        self.save(force=True)
+
+    def is_done(self, key):
+        status = self.data["items"].get(str(key))
+        if status is None and self.sequential:
+            return key <= self.data.get("done_through", 0)
+        return status in self.DONE
+
+    def mark(self, key, status):
+        with self._lock:
+            items = self.data["items"]
+            items[str(key)] = status
+            if self.sequential:
+                # sıradaki konumlar watermark'a katlanır; başarısızlar tekrar denenmek üzere kalır
+                through = self.data.get("done_through", 0)
+                while str(through + 1) in items:
+                    through += 1
+                    if items[str(through)] in self.DONE:
+                        del items[str(through)]
+                self.data["done_through"] = through
+        self.save()
+
+    def save(self, force=False):
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._saved_at < self.save_interval:
+                return
+            self._saved_at = now
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.data, f)
+            os.replace(tmp, self.path)
+
+    def finish(self):
+        """Drops the checkpoint when nothing is left to retry, otherwise flushes it."""
+        failed = [k for k, v in self.data["items"].items() if v not in self.DONE]
+        if failed or self.listing_error:
+            self.save(force=True)
+            if failed:
+                print(f"{len(failed)} item(s) not finished; run again with --resume to retry them.")
+            if self.listing_error:
+                # liste yarıda kaldı: kalan öğeler henüz hiç görülmedi, checkpoint silinmez
+                print(f"Listing stopped early ({self.listing_error}); run again with --resume to continue it.")
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+
+def iter_lines(path):
+    """(line number, stripped line) for every line of a text file, read lazily."""
+    with open(path, "r", encoding="utf-8") as fh:
+        for index, raw in enumerate(fh, start=1):
+            yield index, raw.strip()
+
+# ----------------- LISTING CACHE -----------------
+DEFAULT_CACHE = "snapstream-cache.sqlite3"
+DEFAULT_CACHE_TTL = 12 * 3600
+STREAM_RECORD_LIMIT = 10000  # daha uzun playlist'ler checkpoint'e gömülmez, önbellekteki kopyaya başvurulur
+LISTING_CHUNK = 1000  # önbelleğe yazılan/okunan entry satırı grubu
+INCREMENTAL_KNOWN_STREAK = 20  # bu kadar ardışık bilinen entry görülünce listeleme durur
+
+class ListingCache:
+    """
+    SQLite cache of playlist listings and Coub like pages. Rows younger than
+    `ttl` are served instead of re-listing; older rows are still available
+    to incremental syncs until they are evicted (unused for `retention`
+    seconds, or beyond `max_entries` least recently used rows).
+
+    Playlist listings of any length are stored one entry per row and read
+    back in LISTING_CHUNK batches; their `listings` row only holds the
+    title, entry count and a token naming that exact snapshot.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE, ttl=DEFAULT_CACHE_TTL, retention=30 * 86400, max_entries=5000):
+        import sqlite3
+        self.path = path
+        self.ttl = ttl
+        self.retention = retention
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS listings ("
+                " key TEXT PRIMARY KEY,"
+                " fetched_at REAL NOT NULL,"
+                " used_at REAL NOT NULL,"
+                " payload TEXT NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS listing_entries ("
+                " key TEXT NOT NULL,"
+                " position INTEGER NOT NULL,"
+                " entry_id TEXT,"
+                " payload TEXT NOT NULL,"
+                " PRIMARY KEY (key, position))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS listing_entries_id ON listing_entries (key, entry_id)")
+        self.evict()
+
+    def get(self, key, fresh=True):
+        """Cached payload for key; with fresh=True only if younger than the TTL."""
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT fetched_at, payload FROM listings WHERE key = ?", (key,)).fetchone()
+            if row is None or (fresh and now - row[0] > self.ttl):
+                return None
+            self._conn.execute("UPDATE listings SET used_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[1])
+
+    def put(self, key, payload):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO listings (key, fetched_at, used_at, payload) VALUES (?, ?, ?, ?)",
+                (key, now, now, json.dumps(payload)),
+            )
+
+    def listing(self, key, fresh=True):
+        """Header ({title, count, token}) of a stored playlist listing, or None."""
+        header = self.get(key, fresh=fresh)
+        return header if isinstance(header, dict) and header.get("token") else None
+
+    def iter_listing(self, key):
+        """Entries of the listing stored under key, in order, LISTING_CHUNK rows at a time."""
+        position = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT position, payload FROM listing_entries WHERE key = ? AND position > ?"
+                    " ORDER BY position LIMIT ?", (key, position, LISTING_CHUNK),
+                ).fetchall()
+            if not rows:
+                return
+            for position, payload in rows:
+                yield json.loads(payload)
+
+    def has_listed(self, key, entry_id):
+        """Whether the listing stored under key contains entry_id."""
+        if not entry_id:
+            return False
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM listing_entries WHERE key = ? AND entry_id = ? LIMIT 1", (key, str(entry_id)),
+            ).fetchone()
+        return row is not None
+
+    def listing_writer(self, key):
+        return ListingWriter(self, key)
+
+    def evict(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM listings WHERE used_at < ?", (time.time() - self.retention,))
+            self._conn.execute(
+                "DELETE FROM listings WHERE key NOT IN"
+                " (SELECT key FROM listings ORDER BY used_at DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+            # başlığı silinmiş listelerin ve yarıda kalmış yazımların satırları
+            self._conn.execute("DELETE FROM listing_entries WHERE key NOT IN (SELECT key FROM listings)")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class ListingWriter:
+    """
+    Streams a playlist listing into a ListingCache while it is being
+    extracted. Entries go to a private staging key in LISTING_CHUNK
+    batches; commit() swaps them in under the real key in one transaction,
+    so readers never see a half-written listing.
+    """
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self.staging = f"{key}\n{os.urandom(6).hex()}"
+        self.count = 0
+        self._rows = []
+
+    def add(self, entry):
+        self.count += 1
+        self._rows.append((self.staging, self.count, (entry or {}).get('id'), json.dumps(entry)))
+        if len(self._rows) >= LISTING_CHUNK:
+            self._flush()
+
+    def _flush(self):
+        if not self._rows:
+            return
+        cache = self.cache
+        with cache._lock, cache._conn:
+            cache._conn.executemany(
+                "INSERT OR REPLACE INTO listing_entries (key, position, entry_id, payload) VALUES (?, ?, ?, ?)",
+                self._rows,
+            )
+        self._rows = []
+
+    def commit(self, title):
+        """Publishes the listing; returns its header, or None if the staged rows were lost."""
+        self._flush()
+        header = {'title': title, 'count': self.count, 'token': os.urandom(6).hex()}
+        now = time.time()
+        cache = self.cache
+        with cache._lock, cache._conn:
+            staged = cache._conn.execute("SELECT COUNT(*) FROM listing_entries WHERE key = ?",
+                                         (self.staging,)).fetchone()[0]
+            if staged != self.count:
+                # başka bir süreç evict ile staging satırlarını sildi; eksik liste yayınlanmaz
+                cache._conn.execute("DELETE FROM listing_entries WHERE key = ?", (self.staging,))
+                return None
+            cache._conn.execute("DELETE FROM listing_entries WHERE key = ?", (self.key,))
+            cache._conn.execute("UPDATE listing_entries SET key = ? WHERE key = ?", (self.key, self.staging))
+            cache._conn.execute(
+                "INSERT OR REPLACE INTO listings (key, fetched_at, used_at, payload) VALUES (?, ?, ?, ?)",
+                (self.key, now, now, json.dumps(header)),
+            )
+        return header
+
+    def discard(self):
+        """Drops a listing that did not complete."""
+        self._rows = []
+        with self.cache._lock, self.cache._conn:
+            self.cache._conn.execute("DELETE FROM listing_entries WHERE key = ?", (self.staging,))
+
+def compact_entry(entry):
+    """The part of a flat playlist entry worth caching/checkpointing."""
+    if not entry:
+        return None
+    return {'id': entry.get('id'), 'url': entry.get('url'), 'title': entry.get('title')}
+
+# ----------------- DIRECT DOWNLOADS -----------------
+HASH_BLOCK_SIZE = 4 * 1024 * 1024  # segment sınırları da bu boyuta hizalanır
+
+class BlockHasher:
+    """
+    Content hash computed while a file is written: SHA-256 of every
+    HASH_BLOCK_SIZE block, combined by combine_block_hashes(). Parts that
+    start on a block boundary can be hashed separately and concatenated,
+    so segmented and single-stream downloads get the same hash.
+    """
+
+    def __init__(self):
+        self.blocks = []
+        self.length = 0
+        self._block = hashlib.sha256()
+        self._fill = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        while view:
+            take = min(len(view), HASH_BLOCK_SIZE - self._fill)
+            self._block.update(view[:take])
+            self._fill += take
+            self.length += take
+            view = view[take:]
+            if self._fill == HASH_BLOCK_SIZE:
+                self.blocks.append(self._block.digest())
+                self._block = hashlib.sha256()
+                self._fill = 0
+
+    def finish(self):
+        """Block digests, including the trailing partial block."""
+        if self._fill:
+            self.blocks.append(self._block.digest())
+            self._block = hashlib.sha256()
+            self._fill = 0
+        return self.blocks
+
+    def sync(self, path, offset):
+        """Makes the hasher cover exactly the first `offset` bytes of path (read back only after a resume)."""
+        if self.length == offset:
+            return
+        self.__init__()
+        if offset:
+            with open(path, "rb") as f:
+                while self.length < offset:
+                    data = f.read(min(HASH_BLOCK_SIZE, offset - self.length))
+                    if not data:
+                        break
+                    self.update(data)
+
+def combine_block_hashes(blocks):
+    return hashlib.sha256(b"".join(blocks)).hexdigest()
+
+def _link_duplicate(filename, existing):
+    """Replaces filename with a hardlink to existing (same content); False when that is not possible."""
+    try:
+        if os.path.samefile(filename, existing):
+            return False
+        os.link(existing, filename + ".link")
+    except OSError:
+        return False  # farklı disk ya da hardlink desteklemeyen dosya sistemi: kopya kalır
+    os.replace(filename + ".link", filename)
+    return True
+
+def _finish_download(filename, archive, archive_key, hasher):
+    """Dedups a completed file against the archive's hash index, then records it."""
+    content_hash = combine_block_hashes(hasher.finish()) if hasher is not None else None
+    if archive is None:
+        return
+    existing = archive.find_hash(content_hash, size=os.path.getsize(filename))
+    if existing and _link_duplicate(filename, existing):
+        log(f"Duplicate of {existing}, hardlinked: {filename}")
+        emit_metric("dedup", path=filename, same_as=existing, bytes=os.path.getsize(filename))
+    if archive_key:
+        archive.add(*archive_key, path=filename, content_hash=content_hash)
+
+def _already_downloaded(filename, archive=None, archive_key=None):
+    """Archive / existing-file check shared by the sync and async downloaders."""
+    if archive is not None and archive_key and archive.has(*archive_key):
+        log(f"Skipped (In archive): {archive_key[0]} {archive_key[1]}")
+        return True
     if os.path.exists(filename):
-        print(f"Skipped (Already downloaded): {filename}")
+        log(f"Skipped (Already downloaded): {filename}")
+        if archive is not None and archive_key:
+            archive.add(*archive_key, path=filename)
         return True
+    return False
+
+def _stream_to_part(video_url, part_filename, chunk_size, hasher=None):
+    """
+    Downloads video_url into part_filename, resuming from its current size
+    with a Range request. Raises on any failure; the .part is kept so the
+    next attempt continues where this one stopped. `hasher` (BlockHasher)
+    is fed every byte written.
+    """
+    import requests
+    offset = os.path.getsize(part_filename) if os.path.exists(part_filename) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    with http_get(video_url, retries=0, stream=True, headers=headers) as r:
+        if offset and r.status_code == 416:
+            # .part zaten tam boyutta olabilir; değilse baştan indir
+            total = r.headers.get("Content-Range", "").rpartition("/")[2]
+            if total.isdigit() and int(total) == offset:
+                if hasher is not None:
+                    hasher.sync(part_filename, offset)
+                return
+            os.remove(part_filename)
+            raise RetryableError("stale .part file, restarting")
+        r.raise_for_status()
+        if offset and r.status_code != 206:
+            offset = 0  # sunucu Range desteklemiyor, baştan yaz
+        elif offset:
+            log(f"Resuming at {offset} bytes: {part_filename}")
+        if hasher is not None:
+            hasher.sync(part_filename, offset)
+        length = r.headers.get("Content-Length")
+        expected = offset + int(length) if length and length.isdigit() else None
+        ticket = _disk_guard.admit(os.path.dirname(part_filename), expected or 0, part_filename)
+        try:
+            with open(part_filename, "ab" if offset else "wb") as f:
+                for chunk in r.iter_content(shaped_chunk_size(chunk_size)):
+                    f.write(chunk)
+                    if hasher is not None:
+                        hasher.update(chunk)
+                    throttle_bandwidth(len(chunk))
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            raise RetryableError(str(e))
+        finally:
+            _disk_guard.release(ticket)
+    size = os.path.getsize(part_filename)
+    if expected is not None and size != expected:
+        raise RetryableError(f"incomplete transfer ({size}/{expected} bytes)")
+
+def _fetch_segment(video_url, seg_filename, start, end, chunk_size, hasher=None):
+    """Writes bytes start..end (inclusive) of video_url at the same offsets of seg_filename."""
+    import requests
+    pos = start
+    for attempt in range(_retries + 1):
+        try:
+            with http_get(video_url, retries=0, stream=True, headers={"Range": f"bytes={pos}-{end}"}) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise IOError("server ignored the Range header")
+                with open(seg_filename, "r+b") as f:
+                    f.seek(pos)
+                    for chunk in r.iter_content(shaped_chunk_size(chunk_size)):
+                        chunk = chunk[:end + 1 - pos]
+                        f.write(chunk)
+                        if hasher is not None:
+                            hasher.update(chunk)
+                        pos += len(chunk)
+                        throttle_bandwidth(len(chunk))
+                        if pos > end:
+                            break
+            if pos <= end:
+                raise RetryableError(f"segment ended early at {pos} (expected {end + 1})")
+            return end + 1 - start
+        except (RetryableError, requests.ConnectionError, requests.Timeout,
+                requests.exceptions.ChunkedEncodingError) as e:
+            if attempt >= _retries:
+                raise
+            delay = backoff_delay(attempt, getattr(e, "retry_after", None))
+            count_retry(seg_filename, attempt + 1, delay, e)
+            time.sleep(delay)
+
+def _download_segmented(video_url, filename, segments, threshold, chunk_size, hasher=None):
+    """
+    Downloads video_url over `segments` parallel Range requests into a
+    preallocated file. Returns False without downloading anything when the
+    file is below `threshold` or the server does not advertise byte ranges.
+    Segments start on HASH_BLOCK_SIZE boundaries, so their block hashes
+    are merged into `hasher`.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    with http_request("HEAD", video_url, allow_redirects=True) as head:
+        if head.status_code != 200:
+            return False
+        length = head.headers.get("Content-Length", "")
+        accepts_ranges = head.headers.get("Accept-Ranges", "").lower() == "bytes"
+        final_url = head.url
+    if not accepts_ranges or not length.isdigit() or int(length) < threshold:
+        return False
+
+    size = int(length)
+    # single-stream resume trusts the size of .part, so the sparse
+    # preallocated file gets its own name and never looks "partly done"
+    seg_filename = filename + ".seg.part"
+    # seyrek dosyanın boyutu baştan tam görünür, bu yüzden rezervasyon yol olmadan tutulur
+    ticket = _disk_guard.admit(os.path.dirname(filename), size)
     try:
-        r = requests.get(video_url, stream=True)
-        with open(filename, "wb") as f:
-            for chunk in r.iter_content(1024):
-                f.write(chunk)
-        print(f"Downloaded: {filename}")
-        return True
-    except Exception as e:
-        print(f"Fail: {e}")
+        with open(seg_filename, "wb") as f:
+            f.truncate(size)
+        step = -(-size // segments)
+        step = -(-step // HASH_BLOCK_SIZE) * HASH_BLOCK_SIZE
+        ranges = [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+        hashers = [BlockHasher() for _ in ranges]
+        try:
+            with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+                fetched = sum(pool.map(lambda i: _fetch_segment(final_url, seg_filename, ranges[i][0], ranges[i][1],
+                                                                chunk_size, hashers[i]), range(len(ranges))))
+            if fetched != size or os.path.getsize(seg_filename) != size:
+                raise IOError(f"segmented download size mismatch ({fetched}/{size} bytes)")
+        except BaseException:
+            os.remove(seg_filename)
+            raise
+    finally:
+        _disk_guard.release(ticket)
+    os.replace(seg_filename, filename)
+    if hasher is not None:
+        hasher.blocks = [block for h in hashers for block in h.finish()]
+        hasher.length = size
+    return True
+
+def download_video(video_url, folder, title, file_format="mp4", chunk_size=DEFAULT_CHUNK_SIZE,
+                   archive=None, archive_key=None, segments=1, segment_threshold=DEFAULT_SEGMENT_THRESHOLD):
+    """
+    Streams video_url into folder/title.file_format. Data goes to a `.part`
+    file that is renamed only once complete; an existing `.part` is resumed
+    with an HTTP Range request, and transient failures are retried with
+    backoff. With segments > 1, files of at least segment_threshold bytes
+    on servers that accept ranges are fetched over that many connections.
+    With an archive and an archive_key (platform, media_id) the item is
+    skipped when already archived and recorded once downloaded.
+    """
+    filename = os.path.join(folder, f"{title}.{file_format}")
+    resumed_from = file_size(filename + ".part") or 0
+    started, retries = time.monotonic(), retry_count()
+    status = _download_video_file(video_url, filename, chunk_size, archive, archive_key, segments, segment_threshold)
+    platform, media_id = archive_key or (urllib.parse.urlparse(video_url).netloc, None)
+    nbytes = (file_size(filename) or 0) - resumed_from if status == "done" else None
+    emit_download(platform, media_id, filename, time.monotonic() - started, nbytes, retry_count() - retries,
+                  status=status, resumed_from=resumed_from or None, segments=segments if segments > 1 else None)
+    return status != "failed"
+
+def _download_video_file(video_url, filename, chunk_size, archive, archive_key, segments, segment_threshold):
+    """download_video without the metrics; returns "done", "skipped" or "failed"."""
+    if _already_downloaded(filename, archive, archive_key):
+        return "skipped"
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    part_filename = filename + ".part"
+    hasher = BlockHasher() if archive is not None else None
+    if segments > 1 and not os.path.exists(part_filename):
+        try:
+            if _download_segmented(video_url, filename, segments, segment_threshold, chunk_size, hasher):
+                log(f"Downloaded ({segments} segments): {filename}")
+                _finish_download(filename, archive, archive_key, hasher)
+                return "done"
+        except Exception as e:
+            log(f"Fail: {e}")
+            return "failed"
+    for attempt in range(_retries + 1):
+        try:
+            _stream_to_part(video_url, part_filename, chunk_size, hasher)
+            break
+        except RetryableError as e:
+            if attempt >= _retries:
+                log(f"Fail: {e} (.part kept, will resume on next run)")
+                return "failed"
+            delay = backoff_delay(attempt, e.retry_after)
+            log(f"Retry {attempt + 1}/{_retries} in {delay:.1f}s ({filename}): {e}")
+            count_retry(filename, attempt + 1, delay, e)
+            time.sleep(delay)
+        except Exception as e:
+            log(f"Fail: {e}")
+            return "failed"
+    os.replace(part_filename, filename)
+    log(f"Downloaded: {filename}")
+    _finish_download(filename, archive, archive_key, hasher)
+    return "done"
+
+# ----------------- ASYNC ENGINE -----------------
+async def _stream_to_part_async(session, video_url, part_filename, chunk_size, hasher=None):
+    """asyncio counterpart of _stream_to_part (aiohttp session)."""
+    import asyncio
+    offset = os.path.getsize(part_filename) if os.path.exists(part_filename) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    limiter = get_rate_limiter(urllib.parse.urlparse(video_url).netloc)
+    await asyncio.sleep(limiter.reserve())
+    async with session.get(video_url, headers=headers) as r:
+        if offset and r.status == 416:
+            total = r.headers.get("Content-Range", "").rpartition("/")[2]
+            if total.isdigit() and int(total) == offset:
+                if hasher is not None:
+                    hasher.sync(part_filename, offset)
+                return
+            os.remove(part_filename)
+            raise RetryableError("stale .part file, restarting")
+        if r.status == 429 or r.status in (500, 502, 503, 504):
+            retry_after = parse_retry_after(r.headers.get("Retry-After"))
+            if r.status in (429, 503):
+                limiter.throttled(retry_after)
+            raise RetryableError(f"HTTP {r.status}", retry_after=retry_after)
+        r.raise_for_status()
+        limiter.success()
+        if offset and r.status != 206:
+            offset = 0
+        elif offset:
+            log(f"Resuming at {offset} bytes: {part_filename}")
+        if hasher is not None:
+            hasher.sync(part_filename, offset)
+        length = r.headers.get("Content-Length")
+        expected = offset + int(length) if length and length.isdigit() else None
+        ticket = await _disk_guard.admit_async(os.path.dirname(part_filename), expected or 0, part_filename)
+        try:
+            with open(part_filename, "ab" if offset else "wb") as f:
+                async for chunk in r.content.iter_chunked(shaped_chunk_size(chunk_size)):
+                    f.write(chunk)
+                    if hasher is not None:
+                        hasher.update(chunk)
+                    await throttle_bandwidth_async(len(chunk))
+        finally:
+            _disk_guard.release(ticket)
+    size = os.path.getsize(part_filename)
+    if expected is not None and size != expected:
+        raise RetryableError(f"incomplete transfer ({size}/{expected} bytes)")
+
+async def download_video_async(session, video_url, folder, title, file_format="mp4", chunk_size=DEFAULT_CHUNK_SIZE,
+                               archive=None, archive_key=None):
+    """
+    Same contract as download_video, but runs on an event loop with an
+    aiohttp.ClientSession so hundreds of transfers can share one thread.
+    """
+    filename = os.path.join(folder, f"{title}.{file_format}")
+    resumed_from = file_size(filename + ".part") or 0
+    started = time.monotonic()
+    _retry_count.set(0)  # her task kendi context kopyasında sayar
+    status = await _download_video_file_async(session, video_url, filename, chunk_size, archive, archive_key)
+    platform, media_id = archive_key or (urllib.parse.urlparse(video_url).netloc, None)
+    nbytes = (file_size(filename) or 0) - resumed_from if status == "done" else None
+    emit_download(platform, media_id, filename, time.monotonic() - started, nbytes, retry_count(),
+                  status=status, resumed_from=resumed_from or None)
+    return status != "failed"
+
+async def _download_video_file_async(session, video_url, filename, chunk_size, archive, archive_key):
+    import asyncio
+    import aiohttp
+    if _already_downloaded(filename, archive, archive_key):
+        return "skipped"
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    part_filename = filename + ".part"
+    hasher = BlockHasher() if archive is not None else None
+    for attempt in range(_retries + 1):
+        try:
+            await _stream_to_part_async(session, video_url, part_filename, chunk_size, hasher)
+            break
+        except (RetryableError, aiohttp.ClientPayloadError, aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            if attempt >= _retries:
+                log(f"Fail: {e} (.part kept, will resume on next run)")
+                return "failed"
+            delay = backoff_delay(attempt, getattr(e, "retry_after", None))
+            log(f"Retry {attempt + 1}/{_retries} in {delay:.1f}s ({filename}): {e}")
+            count_retry(filename, attempt + 1, delay, e)
+            await asyncio.sleep(delay)
+        except Exception as e:
+            log(f"Fail: {e}")
+            return "failed"
+    os.replace(part_filename, filename)
+    log(f"Downloaded: {filename}")
+    _finish_download(filename, archive, archive_key, hasher)
+    return "done"
+
+def download_many_async(produce, jobs=64, per_host=8, queue_size=100, chunk_size=DEFAULT_CHUNK_SIZE, archive=None,
+                        on_done=None):
+    """
+    Direct-URL download backend on a single asyncio event loop.
+
+    produce(put) runs in a helper thread and calls put((video_url, folder,
+    title, archive_key)) for every file; put blocks while `queue_size` jobs
+    are waiting; extra trailing items in a job are left for the caller.
+    `jobs` transfers run at once, at most `per_host` per host.
+    on_done(job, ok) is called after each transfer. Returns False when
+    aiohttp is not installed.
+    """
+    try:
+        import aiohttp
+    except ImportError:
+        print("The async backend needs aiohttp: pip install aiohttp")
         return False
+    import asyncio
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        pending = asyncio.Queue(maxsize=max(1, queue_size))
+
+        def put(job):
+            asyncio.run_coroutine_threadsafe(pending.put(job), loop).result()
+
+        connector = aiohttp.TCPConnector(limit=jobs, limit_per_host=per_host)
+        timeout = aiohttp.ClientTimeout(sock_connect=10, sock_read=60)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                         headers={"User-Agent": "Mozilla/5.0"}) as session:
+            async def worker():
+                while True:
+                    job = await pending.get()
+                    if job is None:
+                        return
+                    video_url, folder, title, archive_key = job[:4]
+                    ok = False
+                    try:
+                        ok = await download_video_async(session, video_url, folder, title, chunk_size=chunk_size,
+                                                        archive=archive, archive_key=archive_key)
+                    except Exception as e:
+                        log(f"Fail ({video_url}): {e}")
+                    if on_done is not None:
+                        on_done(job, ok)
+
+            workers = [asyncio.create_task(worker()) for _ in range(jobs)]
+            try:
+                await loop.run_in_executor(None, produce, put)
+            finally:
+                for _ in workers:
+                    await pending.put(None)
+                await asyncio.gather(*workers)
+
+    jobs = max(1, jobs or 1)
+    asyncio.run(main())
+    return True
+
+# ----------------- POST-PROCESSING -----------------
+FFMPEG = "ffmpeg"
+FFPROBE = "ffprobe"
+MP3_QUALITY = "192"
+MP4_VIDEO_CODECS = ("h264", "hevc", "av1")
+MP4_AUDIO_CODECS = ("aac", "mp3")
+# dönüşüm ölçülmemişse kullanılan tahmini CPU saniyesi / medya saniyesi
+DEFAULT_TRANSCODE_COST = {"mp3": 0.02, "mp4": 1.0}
+
+def codec_family(codec):
+    """Normalizes yt-dlp / ffprobe codec names ("avc1.640028", "mp4a.40.2", "h264") to one family name."""
+    c = (codec or "").lower()
+    if c in ("", "none"):
+        return None
+    if c in ("mp3", "mp4a.40.34", "mp4a.6b"):
+        return "mp3"
+    for prefix, family in (("avc", "h264"), ("h264", "h264"), ("hev", "hevc"), ("hvc", "hevc"),
+                           ("h265", "hevc"), ("av01", "av1"), ("av1", "av1"), ("mp4a", "aac"),
+                           ("aac", "aac"), ("vp09", "vp9"), ("vp9", "vp9")):
+        if c.startswith(prefix):
+            return family
+    return c
+
+def probe_media(path):
+    """{'vcodec', 'acodec', 'duration'} of path from ffprobe; empty when ffprobe is unavailable."""
+    cmd = [FFPROBE, "-v", "error", "-show_entries", "stream=codec_type,codec_name:format=duration",
+           "-of", "json", path]
+    try:
+        out = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+        data = json.loads(out or b"{}")
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return {}
+    media = {}
+    for stream in data.get("streams", []):
+        key = {"video": "vcodec", "audio": "acodec"}.get(stream.get("codec_type"))
+        if key and key not in media:
+            media[key] = stream.get("codec_name")
+    try:
+        media["duration"] = float(data.get("format", {}).get("duration"))
+    except (TypeError, ValueError):
+        pass
+    return media
+
+def plan_conversion(src, target_format, media):
+    """
+    Cheapest way to turn src into target_format: ("skip", None) when it
+    already is one, ("copy", args) when the streams can be remuxed as-is,
+    otherwise ("transcode", args).
+    """
+    if os.path.splitext(src)[1].lstrip(".").lower() == target_format:
+        return "skip", None
+    vcodec = codec_family(media.get("vcodec"))
+    acodec = codec_family(media.get("acodec"))
+    if target_format == "mp3":
+        if acodec == "mp3":
+            return "copy", ["-vn", "-c:a", "copy"]
+        return "transcode", ["-vn", "-c:a", "libmp3lame", "-b:a", f"{MP3_QUALITY}k"]
+    if (vcodec or acodec) and vcodec in (None,) + MP4_VIDEO_CODECS and acodec in (None,) + MP4_AUDIO_CODECS:
+        return "copy", ["-c", "copy"]
+    return "transcode", []
+
+def run_ffmpeg(cmd):
+    """Runs ffmpeg and returns the CPU seconds it used (wall time where wait4 is unavailable)."""
+    started = time.monotonic()
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = proc.stderr.read()
+    proc.stderr.close()
+    if hasattr(os, "wait4"):
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+        cpu = usage.ru_utime + usage.ru_stime
+    else:
+        proc.wait()
+        cpu = time.monotonic() - started
+    if proc.returncode != 0:
+        raise RuntimeError(stderr.decode("utf-8", "replace").strip()[-500:] or f"ffmpeg exit {proc.returncode}")
+    return cpu
+
+def convert_media(src, target_format, media=None):
+    """
+    Converts src into a file with the same base name and target_format
+    ("mp3" = audio extraction, "mp4" = video conversion) and removes src.
+    Codecs come from `media` (yt-dlp info) or ffprobe; compatible streams
+    are copied instead of re-encoded. Returns (path, action, cpu_seconds, duration).
+    """
+    media = dict(media or {})
+    if not media.get("acodec") and not media.get("vcodec"):
+        media.update(probe_media(src))
+    action, codec_args = plan_conversion(src, target_format, media)
+    duration = media.get("duration")
+    if action == "skip":
+        return src, action, 0.0, duration
+    base = os.path.splitext(src)[0]
+    dst = f"{base}.{target_format}"
+    if os.path.exists(dst):
+        os.remove(src)
+        return dst, "skip", 0.0, duration
+    tmp = f"{base}.convert.{target_format}"
+    try:
+        cpu = run_ffmpeg([FFMPEG, "-y", "-loglevel", "error", "-i", src, *codec_args, tmp])
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, dst)
+    os.remove(src)
+    return dst, action, cpu, duration
+
+class PostProcessQueue:
+    """
+    FFmpeg stage of the download pipeline. Finished downloads are queued
+    here and converted by `workers` ffmpeg processes (one per CPU core by
+    default) while the downloaders move on to the next item. Files that
+    already match the target are left alone or stream-copied, and the
+    CPU time that saved is reported by close().
+    """
+
+    def __init__(self, workers=None):
+        from concurrent.futures import ThreadPoolExecutor
+        self.workers = workers or os.cpu_count() or 1
+        # her iş ayrı bir ffmpeg süreci; thread'ler yalnızca onu bekler
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ffmpeg")
+        self._lock = threading.Lock()
+        self.stats = {"transcode": 0, "copy": 0, "skip": 0, "failed": 0}
+        self._transcode_cpu = {}    # hedef format -> (cpu saniyesi, medya saniyesi)
+        self._avoided_media = {}    # hedef format -> transcode edilmeyen medya saniyesi
+        self._copy_cpu = 0.0
+
+    def submit(self, src, target_format, on_done=None, media=None):
+        """Queues src for conversion; on_done(final_path) runs after success."""
+        def run():
+            started = time.monotonic()
+            try:
+                dst, action, cpu, duration = convert_media(src, target_format, media)
+            except Exception as e:
+                log(f"Convert fail ({src}): {e}")
+                emit_metric("postprocess", path=src, target=target_format, status="failed",
+                            seconds=round(time.monotonic() - started, 3), error=str(e)[:200])
+                with self._lock:
+                    self.stats["failed"] += 1
+                return None
+            emit_metric("postprocess", path=dst, target=target_format, status=action,
+                        seconds=round(time.monotonic() - started, 3), cpu_seconds=round(cpu, 3), media_seconds=duration)
+            with self._lock:
+                self.stats[action] += 1
+                if action == "transcode":
+                    spent, seconds = self._transcode_cpu.get(target_format, (0.0, 0.0))
+                    if duration:
+                        self._transcode_cpu[target_format] = (spent + cpu, seconds + duration)
+                else:
+                    self._copy_cpu += cpu
+                    # yalnızca eski hattın gerçekten yeniden kodlayacağı dosyalar sayılır: mp3 çıkarma
+                    # her zaman kodluyordu, mp4'te ise uzantısı zaten mp4 olanlar eskiden de atlanıyordu
+                    if action == "copy" or target_format == "mp3":
+                        self._avoided_media[target_format] = (self._avoided_media.get(target_format, 0.0)
+                                                              + (duration or 0.0))
+            if action != "skip":
+                log(f"Converted ({action}): {dst}")
+            if on_done is not None:
+                on_done(dst)
+            return dst
+
+        return self._pool.submit(run)
+
+    def cpu_seconds_avoided(self):
+        """
+        Estimated CPU seconds saved versus the old inline pipeline (which
+        re-encoded every mp3 extraction and every non-mp4 file converted to
+        mp4), from the measured transcode cost.
+        """
+        with self._lock:
+            avoided = 0.0
+            for target_format, media_seconds in self._avoided_media.items():
+                spent, seconds = self._transcode_cpu.get(target_format, (0.0, 0.0))
+                cost = spent / seconds if seconds else DEFAULT_TRANSCODE_COST.get(target_format, 1.0)
+                avoided += media_seconds * cost
+            return max(0.0, avoided - self._copy_cpu)
+
+    def close(self):
+        """Waits for every queued conversion and prints the stage summary."""
+        self._pool.shutdown(wait=True)
+        if any(self.stats.values()):
+            print(f"FFmpeg: {self.stats['transcode']} transcoded, {self.stats['copy']} stream-copied, "
+                  f"{self.stats['skip']} already in target format, {self.stats['failed']} failed; "
+                  f"~{self.cpu_seconds_avoided():.1f} CPU-s avoided")
+
+def queue_postprocessing(postprocessor, info, target_format, on_done=None):
+    """
+    Hands the file of a finished yt-dlp download, with its codec info, to
+    the FFmpeg stage. Returns the conversion future (None when no file).
+    """
+    path = downloaded_filepath(info)
+    if path and os.path.exists(path):
+        media = {key: info.get(key) for key in ("vcodec", "acodec", "duration") if info.get(key)}
+        return postprocessor.submit(path, target_format, on_done=on_done, media=media)
+    return None
 
 # ----------------- COUB -----------------
+COUB_API_BASE = "https://coub.com/api/v2"
+COUB_PER_PAGE = 50
+
 def get_coub_items(headers, username=None, item_type="likes", page=1):
+    """
+    One timeline page. An empty list means the timeline really ended; a
+    page that could not be fetched (retries used up, non-200) raises, so a
+    429 is never mistaken for the last page.
+    """
     if item_type == "likes":
-        url = f"https://coub.com/api/v2/timeline/likes?per_page=50&page={page}"
+        url = f"{COUB_API_BASE}/timeline/likes?per_page={COUB_PER_PAGE}&page={page}"
     else:
         return []
-    r = requests.get(url, headers=headers)
+    r = http_get(url, headers=headers)  # RetryableError tekrar denemeler bitince yukarı çıkar
     if r.status_code != 200:
-        print("Hata:", r.status_code, r.text[:200])
-        return []
+        raise IOError(f"timeline page {page}: HTTP {r.status_code} {r.text[:200]}")
     return r.json().get("coubs", [])
 
-def download_coub_likes(session, token):
+def coub_file_title(folder, title, coub_id, archive=None, claimed=None):
+    """
+    File title for a coub: its own title, or "title [id]" when that name
+    already belongs to another coub in the archive or in this run.
+    """
+    owner = archive.owner(os.path.join(folder, f"{title}.mp4")) if archive is not None else None
+    if (claimed is not None and title in claimed) or (owner is not None and owner != ("coub", str(coub_id))):
+        log(f"Title collision, saving as: {title} [{coub_id}]")
+        return f"{title} [{coub_id}]"
+    return title
+
+def coub_id_from_url(url):
+    """Coub permalink from a coub.com/view/<id> (or /embed/<id>) URL."""
+    m = re.search(r'coub\.com/(?:view|embed)/([A-Za-z0-9]+)', url)
+    return m.group(1) if m else None
+
+def download_coub(url, folder="coub_videos", archive=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Downloads a single coub by its page URL through the public coubs API."""
+    coub_id = coub_id_from_url(url)
+    if not coub_id:
+        log(f"Not a coub URL: {url}")
+        return False
+    # arşiv anahtarı likes ile aynı olsun diye sayısal id API cevabından alınır
+    r = http_get(f"{COUB_API_BASE}/coubs/{coub_id}", headers={"User-Agent": "Mozilla/5.0"})
+    if r.status_code != 200:
+        log(f"Hata: {r.status_code} {r.text[:200]}")
+        return False
+    c = r.json()
+    video_url = ((c.get("file_versions") or {}).get("share") or {}).get("default")
+    if not video_url:
+        log(f"No downloadable file: coub {coub_id}")
+        return False
+    title = coub_file_title(folder, (c.get("title") or f"coub_{coub_id}").replace("/", "_"), c.get("id") or coub_id, archive)
+    return download_video(video_url, folder, title, chunk_size=chunk_size, archive=archive,
+                          archive_key=("coub", c.get("id") or coub_id))
+
+def download_coub_likes(session, token, jobs=4, prefetch=2, chunk_size=DEFAULT_CHUNK_SIZE, archive=None,
+                        backend="threads", per_host=8, segments=1, segment_threshold=DEFAULT_SEGMENT_THRESHOLD,
+                        resume=False, cache=None, incremental=False):
+    """
+    Producer/consumer pipeline: one thread pages through the likes timeline
+    while `jobs` workers download. The queue holds at most `prefetch` pages
+    of items, so paging pauses when the workers fall behind. With
+    backend="async" the workers are coroutines (see download_many_async).
+    The page cursor and per-coub status are checkpointed for --resume.
+    Pages are always listed live and written to the listing cache;
+    incremental=True reuses pages younger than the cache TTL and stops at
+    the first fully known page.
+    """
+    import queue
+    import threading
+
     headers = {
         "User-Agent": "Mozilla/5.0",
         "Cookie": f"{session}; remember_token={token}"
     }
     folder = "coub_likes"
-    page = 1
-    while True:
+    jobs = max(1, jobs or 1)
+    queue_size = max(1, prefetch) * COUB_PER_PAGE
+    claimed_names = set()
+    state = JobState.open(folder, "coub-likes", "likes", resume)
+    # sayfa -> bitmemiş iş sayısı; cursor bitmemiş (ya da başarısız) işi olan ilk sayfada kalır
+    page_lock = threading.Lock()
+    open_pages = {}
+    fetched_pages = [state.cursor or 1]
+
+    def advance_cursor():
+        with page_lock:
+            pending = [p for p, n in open_pages.items() if n > 0]
+            cursor = min(pending) if pending else fetched_pages[0]
+        state.cursor = cursor
+
+    def job_done(job, ok):
+        page, coub_id = job[4], job[3][1]
+        state.mark(coub_id, "done" if ok else "failed")
+        if ok:
+            with page_lock:
+                open_pages[page] -= 1
+            advance_cursor()
+
+    cache_prefix = "coub-likes:" + hashlib.sha1(token.encode("utf-8")).hexdigest()[:12]
+    known_ids = set(cache.get(cache_prefix + ":ids", fresh=False) or []) if cache is not None else set()
+    seen_ids = set()
+
+    def fetch_page(page):
+        key = f"{cache_prefix}:page:{page}"
+        # önbellekteki sayfalar yalnızca --incremental'da kullanılır; normal çalışma her zaman canlı listeler
+        if cache is not None and incremental:
+            cached = cache.get(key)
+            if cached is not None:
+                emit_metric("page", platform="coub", page=page, items=len(cached), cached=True)
+                return cached
+        started, retries = time.monotonic(), retry_count()
         coubs = get_coub_items(headers, item_type="likes", page=page)
-        if not coubs:
-            break
-        for c in coubs:
-            title = c["title"] or f"coub_{c['id']}"
-            video_url = c["file_versions"]["share"]["default"]
-            if video_url:
-                download_video(video_url, folder, title.replace("/", "_"))
-        page += 1
+        emit_metric("page", platform="coub", page=page, items=len(coubs), cached=False,
+                    seconds=round(time.monotonic() - started, 3), retries=retry_count() - retries)
+        if cache is not None and coubs:
+            cache.put(key, [{"id": c.get("id"), "title": c.get("title"), "file_versions": c.get("file_versions")}
+                            for c in coubs])
+        return coubs
+
+    def is_known(c):
+        return (c.get("id") in known_ids or state.is_done(c.get("id"))
+                or (archive is not None and archive.has("coub", c.get("id"))))
+
+    def prepare(c):
+        """Download job for a coub, or None when it is archived or has no file."""
+        if state.is_done(c.get("id")):
+            return None
+        if archive is not None and archive.has("coub", c.get("id")):
+            log(f"Skipped (In archive): coub {c.get('id')}")
+            return None
+        title = (c["title"] or f"coub_{c['id']}").replace("/", "_")
+        video_url = c["file_versions"]["share"]["default"]
+        if not video_url:
+            return None
+        # aynı başlıklı farklı coub'lar "title [id]" olarak kaydedilir, atlanmaz
+        title = coub_file_title(folder, title, c["id"], archive, claimed_names)
+        claimed_names.add(title)
+        return (video_url, folder, title, ("coub", c["id"]))
+
+    def produce(put):
+        page = state.cursor or 1
+        if page > 1:
+            print(f"Resuming Coub likes at page {page}")
+        state.listing_error = None
+        while True:
+            try:
+                coubs = fetch_page(page)
+            except Exception as e:
+                # cursor bu sayfada kalır (fetched_pages ilerlemez); --resume buradan devam eder
+                log(f"Coub likes listing stopped at page {page}: {e}")
+                state.listing_error = f"page {page}: {e}"
+                break
+            if not coubs:
+                break
+            if incremental and (known_ids or archive is not None) and all(is_known(c) for c in coubs):
+                log(f"Incremental sync: page {page} is already known, stopping.")
+                break
+            seen_ids.update(c.get("id") for c in coubs)
+            with page_lock:
+                open_pages[page] = open_pages.get(page, 0)
+            for c in coubs:
+                try:
+                    job = prepare(c)
+                except Exception as e:
+                    log(f"Fail (coub {c.get('id')}): {e}")
+                    state.mark(c.get("id"), "failed")
+                    continue
+                if job:
+                    with page_lock:
+                        open_pages[page] += 1
+                    put(job + (page,))  # kuyruk doluysa burada bekler (backpressure)
+            with page_lock:
+                fetched_pages[0] = page + 1
+            advance_cursor()
+            page += 1
+
+    def remember_ids():
+        if cache is not None and seen_ids:
+            cache.put(cache_prefix + ":ids", sorted(known_ids | seen_ids))
+
+    if backend == "async":
+        download_many_async(produce, jobs=jobs, per_host=per_host, queue_size=queue_size,
+                            chunk_size=chunk_size, archive=archive, on_done=job_done)
+        remember_ids()
+        state.finish()
+        return
+
+    items = queue.Queue(maxsize=queue_size)
+
+    def run_producer():
+        try:
+            produce(items.put)
+        finally:
+            for _ in range(jobs):
+                items.put(None)
+
+    def consume():
+        while True:
+            job = items.get()
+            if job is None:
+                return
+            video_url, folder_, title, archive_key = job[:4]
+            ok = False
+            try:
+                ok = download_video(video_url, folder_, title, chunk_size=chunk_size,
+                                    archive=archive, archive_key=archive_key,
+                                    segments=segments, segment_threshold=segment_threshold)
+            except Exception as e:
+                log(f"Fail ({video_url}): {e}")
+            job_done(job, ok)
+
+    producer = threading.Thread(target=run_producer, name="coub-pages", daemon=True)
+    workers = [threading.Thread(target=consume, name=f"coub-dl-{i}", daemon=True) for i in range(jobs)]
+    producer.start()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    producer.join()
+    remember_ids()
+    state.finish()
 
 # ----------------- YOUTUBE -----------------
-def download_youtube_video(url, file_format="mp4"):
-    import yt_dlp
-    folder = "youtube_videos"
-    os.makedirs(folder, exist_ok=True)
+def youtube_video_opts(file_format="mp4", folder="youtube_videos"):
+    """yt-dlp options of a single YouTube video download (mp4 up to 1080p, or best audio for mp3)."""
     if file_format == "mp3":
-        ydl_opts = {
+        return {
             'format': 'bestaudio/best',
             'outtmpl': os.path.join(folder, '%(title)s.%(ext)s'),
+            'final_ext': 'mp3',  # mp3 FFmpeg havuzunda üretilir; yt-dlp var olan .mp3'ü tanısın, tekrar indirmesin
             'noplaylist': True,
             'quiet': False,
             'nooverwrites': True,
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
+            **ytdlp_transfer_opts(folder),
         }
+    return {
+        'format': 'bestvideo[ext=mp4][vcodec^=avc1][height<=1080]+bestaudio[ext=m4a]/best[ext=mp4][vcodec^=avc1][height<=1080]/best[ext=mp4][vcodec^=avc1]',
+        'outtmpl': os.path.join(folder, '%(title)s.%(ext)s'),
+        'merge_output_format': 'mp4',
+        'noplaylist': True,
+        'quiet': False,
+        'nooverwrites': True,
+        **ytdlp_transfer_opts(folder),
+    }
+
+def download_youtube_video(url, file_format="mp4", archive=None, postprocessor=None, ydl=None):
+    """
+    Downloads one video. `ydl` lets batch workers reuse a YoutubeDL built
+    from youtube_video_opts(). Returns False when nothing was downloaded.
+    """
+    import yt_dlp
+    if archive is not None and archive.has("youtube", youtube_video_id(url)):
+        print(f"Skipped (In archive): youtube {youtube_video_id(url)}")
+        return True
+    folder = "youtube_videos"
+    os.makedirs(folder, exist_ok=True)
+    # FFmpeg (mp3 çıkarma / mp4 dönüştürme) indirmeden ayrı havuzda çalışır
+    own_postprocessor = postprocessor is None
+    if own_postprocessor:
+        postprocessor = PostProcessQueue()
+    started, retries = time.monotonic(), retry_count()
+    if ydl is None:
+        with yt_dlp.YoutubeDL(youtube_video_opts(file_format, folder)) as own_ydl:
+            info = ytdlp_call("youtube", lambda: own_ydl.extract_info(url, download=True), label=url)
     else:
-        ydl_opts = {
-            'format': 'bestvideo[ext=mp4][vcodec^=avc1][height<=1080]+bestaudio[ext=m4a]/best[ext=mp4][vcodec^=avc1][height<=1080]/best[ext=mp4][vcodec^=avc1]',
-            'outtmpl': os.path.join(folder, '%(title)s.%(ext)s'),
-            'merge_output_format': 'mp4',
-            'noplaylist': True,
-            'quiet': False,
-            'nooverwrites': True,
-            'postprocessors': [{
-                'key': 'FFmpegVideoConvertor',
-                'preferedformat': 'mp4',
-            }],
-        }
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        ydl.download([url])
+        info = ytdlp_call("youtube", lambda: ydl.extract_info(url, download=True), label=url)
+    if info:
+        emit_download("youtube", info.get('id'), downloaded_filepath(info), time.monotonic() - started,
+                      file_size(downloaded_filepath(info)), retry_count() - retries)
+        on_done = (lambda path: archive.add("youtube", info.get('id'), path=path)) if archive is not None else None
+        queue_postprocessing(postprocessor, info, file_format, on_done=on_done)
+    if own_postprocessor:
+        postprocessor.close()
+    return bool(info)
 
-def download_youtube_playlist(playlist_url, file_format="mp4"):
+def download_youtube_playlist(playlist_url, file_format="mp4", jobs=1, archive=None, resume=False,
+                              cache=None, incremental=False, postprocessor=None):
     import os
     import yt_dlp
+    import threading
     import traceback
+    from concurrent.futures import ThreadPoolExecutor
     from datetime import datetime, timezone
     from urllib.parse import urlparse, parse_qs
 
@@ -111,13 +1865,10 @@ def download_youtube_playlist(playlist_url, file_format="mp4"):
         downloader_opts = {
             'format': 'bestaudio/best',
             'outtmpl': os.path.join(folder, '%(playlist_title)s/%(title)s.%(ext)s'),
+            'final_ext': 'mp3',
             'quiet': False,
             'nooverwrites': True,
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
+            **ytdlp_transfer_opts(folder),
         }
     else:
         downloader_opts = {
@@ -126,12 +1877,12 @@ def download_youtube_playlist(playlist_url, file_format="mp4"):
             'merge_output_format': 'mp4',
             'quiet': False,
             'nooverwrites': True,
-            'postprocessors': [{
-                'key': 'FFmpegVideoConvertor',
-                # yt-dlp expects the misspelled 'preferedformat'
-                'preferedformat': 'mp4',
-            }],
+            **ytdlp_transfer_opts(folder),
         }
+    # mp3 çıkarma / mp4 dönüştürme ayrı FFmpeg havuzunda: N+1'in indirmesi N'in dönüşümüyle örtüşür
+    own_postprocessor = postprocessor is None
+    if own_postprocessor:
+        postprocessor = PostProcessQueue()
 
     # Extractor options: sadece playlist yapısını al, videoların tamamını çözmeye çalışmasın
     extractor_opts = {
@@ -140,36 +1891,230 @@ def download_youtube_playlist(playlist_url, file_format="mp4"):
         'extract_flat': 'in_playlist'  # videoların tam metadata'sını çekme, sadece listeler/ids al
     }
 
-    try:
-        extractor = yt_dlp.YoutubeDL(extractor_opts)
-        playlist_info = extractor.extract_info(playlist_url, download=False)
-    except Exception as e:
-        with open(debug_file, "a", encoding="utf-8") as f:
-            f.write(f"[{datetime.now(timezone.utc).isoformat()}] PLAYLIST-EXTRACTION-ERROR: {playlist_url}\n")
-            f.write(f"Error: {str(e)}\n")
-            f.write(traceback.format_exc() + "\n\n")
-        print(f"Playlist extraction failed: {e}. Logged to {debug_file}")
-        return
+    state = JobState.open(folder, "youtube-playlist", playlist_url, resume, sequential=True)
+    cache_key = f"youtube-playlist:{playlist_url}"
+
+    def record_listing(writer, recorded):
+        # entry konumları yalnızca bu listeye göre geçerli: checkpoint, önbellekteki kopyanın token'ını tutar
+        state.data['title'] = playlist_info.get('title')
+        header = None
+        if writer is not None:
+            header = writer.commit(playlist_info.get('title'))
+            state.data['listing'] = header and header['token']
+        if recorded is not None:
+            state.entries = recorded
+        else:
+            state.save(force=True)
+        return header
 
-    entries = playlist_info.get('entries') or []
-    total = len(entries)
-    print(f"Playlist '{playlist_info.get('title')}' içinde {total} öğe bulundu. İndirme başlıyor...")
+    def stream_entries(info, writer):
+        """
+        Compact entries as the extractor pages through the playlist. Once
+        the listing is complete it is stored in the cache (any length) and,
+        up to STREAM_RECORD_LIMIT entries, in the checkpoint itself.
+        """
+        recorded = []
+        try:
+            for e in info.get('entries') or []:
+                e = compact_entry(e)
+                if writer is not None:
+                    writer.add(e)
+                if recorded is not None:
+                    recorded.append(e)
+                    if len(recorded) > STREAM_RECORD_LIMIT:
+                        recorded = None
+                yield e
+        except Exception as e:
+            log(f"Playlist listing stopped: {e}. Logged to {debug_file}",
+                [f"PLAYLIST-LISTING-ERROR: {playlist_url}", f"Error: {str(e)}", traceback.format_exc()])
+            state.listing_error = e
+            if writer is not None:
+                writer.discard()
+            return
+        record_listing(writer, recorded)
 
-    # Her bir entry için tek tek indir
-    for idx, entry in enumerate(entries, start=1):
-        if not entry:
+    # --resume yalnızca checkpoint'in yazıldığı listenin aynısıyla konum üzerinden devam eder;
+    # liste artık yoksa yeniden listelenir ve bitmiş videolar id ile (arşiv / mevcut dosya) atlanır
+    snapshot = cache.listing(cache_key, fresh=False) if cache is not None and resume else None
+    if state.entries is None and not (snapshot and snapshot['token'] == state.data.get('listing')):
+        snapshot = None
+        if resume and (state.data.get('done_through') or state.data['items']):
+            print("Checkpoint'teki playlist listesi artık yok; playlist yeniden listeleniyor, "
+                  "indirilmiş videolar id ile atlanacak.")
+            state.restart()
+    # önbellek yalnızca --incremental'da okunur: TTL içindeki liste aynen, daha eskisi
+    # yeni entry'lerin ekleneceği taban olarak kullanılır. Normal çalışma her zaman canlı listeler.
+    cached = fresh_cached = None
+    if cache is not None and incremental:
+        fresh_cached = cache.listing(cache_key)
+        cached = fresh_cached or cache.listing(cache_key, fresh=False)
+    total = None
+    if state.entries is not None:
+        # --resume: playlist tekrar çıkarılmaz, kayıtlı entry listesi kullanılır
+        playlist_info = {'title': state.data.get('title')}
+        entries = state.entries
+        total = len(entries)
+    elif snapshot is not None:
+        print(f"Playlist listesi checkpoint'in önbellekteki kopyasından alındı ({snapshot['count']} öğe).")
+        playlist_info = {'title': snapshot['title']}
+        entries = cache.iter_listing(cache_key)
+        total = snapshot['count']
+    elif fresh_cached is not None:
+        print(f"Playlist listesi önbellekten alındı ({fresh_cached['count']} öğe).")
+        playlist_info = {'title': fresh_cached['title']}
+        state.data.update(title=fresh_cached['title'], listing=fresh_cached['token'])
+        entries = cache.iter_listing(cache_key)
+        total = fresh_cached['count']
+    else:
+        try:
+            extractor = yt_dlp.YoutubeDL(extractor_opts)
+            if cached is not None:
+                # incremental: en yeni entry'lerden başlayıp bilinen entry'lere ulaşınca dur
+                playlist_info = ytdlp_call("youtube", lambda: extractor.extract_info(playlist_url, download=False,
+                                                                                     process=False),
+                                           label=playlist_url)
+                writer = cache.listing_writer(cache_key)
+                new_count = streak = 0
+                for e in playlist_info.get('entries') or []:
+                    if e and cache.has_listed(cache_key, e.get('id')):
+                        streak += 1
+                        if streak >= INCREMENTAL_KNOWN_STREAK:
+                            break
+                        continue
+                    streak = 0
+                    writer.add(compact_entry(e))
+                    new_count += 1
+                print(f"Incremental sync: {new_count} yeni öğe.")
+                # tarama yalnızca listenin başına bakar (en yeni önce varsayımı); toplam tutmuyorsa playlist
+                # eskiden yeniye sıralı ya da içinden öğe silinmiş olabilir, o zaman tam listelemeye dönülür
+                listed_total = playlist_info.get('playlist_count')
+                if listed_total is not None and listed_total != new_count + cached['count']:
+                    print(f"Playlist'te {listed_total} öğe var, önbellek + yeni = {new_count + cached['count']}; "
+                          f"tam listeleme yapılıyor.")
+                    writer.discard()
+                    cached = None
+                else:
+                    if listed_total is None:
+                        print("Uyarı: playlist öğe sayısı alınamadı, sıralama doğrulanamadı; sona eklenen "
+                              "videolar görünmeyebilir (tam listeleme için --incremental olmadan çalıştırın).")
+                    for e in cache.iter_listing(cache_key):
+                        writer.add(e)
+                    if record_listing(writer, None) is None:
+                        raise IOError("listing cache changed while the incremental listing was written")
+                    entries = cache.iter_listing(cache_key)
+                    total = writer.count
+            if cached is None:
+                # process=False: entry'ler extractor sayfaları gezdikçe gelir, ilk video hemen başlar
+                playlist_info = ytdlp_call("youtube", lambda: extractor.extract_info(playlist_url, download=False,
+                                                                                     process=False),
+                                           label=playlist_url)
+                state.listing_error = None
+                entries = stream_entries(playlist_info, cache.listing_writer(cache_key) if cache is not None else None)
+        except Exception as e:
             with open(debug_file, "a", encoding="utf-8") as f:
-                f.write(f"[{datetime.now(timezone.utc).isoformat()}] ENTRY NONE: index={idx}\n\n")
-            print(f"[{idx}/{total}] Entry None, atlanıyor.")
-            continue
+                f.write(f"[{datetime.now(timezone.utc).isoformat()}] PLAYLIST-EXTRACTION-ERROR: {playlist_url}\n")
+                f.write(f"Error: {str(e)}\n")
+                f.write(traceback.format_exc() + "\n\n")
+            print(f"Playlist extraction failed: {e}. Logged to {debug_file}")
+            return
+
+    if total is not None:
+        print(f"Playlist '{playlist_info.get('title')}' içinde {total} öğe bulundu. İndirme başlıyor...")
+    else:
+        total = playlist_info.get('playlist_count') or "?"
+        print(f"Playlist '{playlist_info.get('title')}' listeleniyor, indirme listeleme sürerken başlıyor...")
+
+    jobs = max(1, jobs or 1)
+    if jobs > 1:
+        # paralel indirmede yt-dlp progress satırları birbirine karışmasın
+        downloader_opts['noprogress'] = True
+
+    # print() ve youtube-debug.txt yazımları modül genelindeki log_lock ile sıralanır
+    # (download_video ve FFmpeg satırları da aynı kilidi kullanır)
+    worker_state = threading.local()
+    downloaders = []
+    claimed_paths = {}  # indirilmekte olan uzantısız çıktı yolu -> video id; iş bitince silinir
+    run_started = time.time()
+    # bitmiş çıktıların sahibi arşivden okunur; --no-archive'da bu çalışmaya özel geçici bir arşiv tutulur
+    owners = archive
+    if owners is None:
+        import tempfile
+        owners_dir = tempfile.mkdtemp(prefix="snapstream-owners-")
+        owners = DownloadArchive(os.path.join(owners_dir, "owners.sqlite3"))
+
+    def log(message, debug_lines=None):
+        with log_lock:
+            if debug_lines:
+                with open(debug_file, "a", encoding="utf-8") as f:
+                    f.write(f"[{datetime.now(timezone.utc).isoformat()}] " + "\n".join(debug_lines) + "\n\n")
+            print(message)
+
+    def get_downloader():
+        # her worker thread'i kendi YoutubeDL örneğini bir kez kurar ve tekrar kullanır
+        dl = getattr(worker_state, "dl", None)
+        if dl is None:
+            dl = yt_dlp.YoutubeDL(downloader_opts)
+            worker_state.dl = dl
+            with log_lock:
+                downloaders.append(dl)
+        return dl
+
+    def output_key(path):
+        # uzantı postprocessor ile değişebileceği için uzantısız yol anahtar olarak kullanılır
+        return os.path.normcase(os.path.abspath(os.path.splitext(path)[0]))
+
+    def claim_output_path(path, video_id):
+        """
+        Claims path for video_id so two same-title videos do not write to
+        the same %(playlist_title)s/%(title)s file. Returns the id of the
+        video already writing it, or None once claimed. Only in-flight
+        downloads are held here; release_output_path() drops the claim.
+        """
+        key = output_key(path)
+        with log_lock:
+            owner = claimed_paths.get(key)
+            if owner is None:
+                claimed_paths[key] = video_id
+            return owner
+
+    def release_output_path(path):
+        with log_lock:
+            claimed_paths.pop(output_key(path), None)
+
+    def finished_output_owner(path):
+        """
+        Video id of a finished file at path (or its converted extension),
+        None when there is none. The archive decides when it knows the file;
+        otherwise a file written since this run started came from another
+        video ("") and an older one is left to yt-dlp's overwrite check.
+        """
+        base = os.path.splitext(path)[0]
+        for candidate in dict.fromkeys((path, f"{base}.{file_format}")):
+            if not os.path.exists(candidate):
+                continue
+            archived = owners.owner(candidate)
+            if archived is not None:
+                return archived[1] if archived[0] == "youtube" else f"{archived[0]}:{archived[1]}"
+            return None if os.path.getmtime(candidate) < run_started else ""
+        return None
+
+    def download_entry(idx, entry):
+        started, retries = time.monotonic(), retry_count()
+        status = download_entry_status(idx, entry)
+        state.mark(idx, status)
+        emit_metric("item", platform="youtube", index=idx, id=(entry or {}).get('id'), status=status,
+                    seconds=round(time.monotonic() - started, 3), retries=retry_count() - retries)
+
+    def download_entry_status(idx, entry):
+        if not entry:
+            log(f"[{idx}/{total}] Entry None, atlanıyor.", [f"ENTRY NONE: index={idx}"])
+            return "skipped"
 
         # extract_flat ile gelen entry'de 'url' genellikle video id olabilir; güvenli şekilde url oluştur
         video_id = entry.get('id') or entry.get('url')
         if not video_id:
-            with open(debug_file, "a", encoding="utf-8") as f:
-                f.write(f"[{datetime.now(timezone.utc).isoformat()}] NO-ID: entry={entry}\n\n")
-            print(f"[{idx}/{total}] ID yok, atlanıyor.")
-            continue
+            log(f"[{idx}/{total}] ID yok, atlanıyor.", [f"NO-ID: entry={entry}"])
+            return "skipped"
 
         # video_url oluştur
         if video_id.startswith("http"):
@@ -177,66 +2122,172 @@ def download_youtube_playlist(playlist_url, file_format="mp4"):
         else:
             video_url = f"https://www.youtube.com/watch?v={video_id}"
 
-        print(f"[{idx}/{total}] İndiriliyor: {video_url}")
+        archive_id = youtube_video_id(video_url) or video_id
+        if archive is not None and archive.has("youtube", archive_id):
+            log(f"[{idx}/{total}] Arşivde var, atlanıyor: {video_url}")
+            return "skipped"
+
+        log(f"[{idx}/{total}] İndiriliyor: {video_url}")
 
-        # her video için yeni downloader örneği (ayrıştırma ve indirme farklı ayarlarla)
         try:
-            dl = yt_dlp.YoutubeDL(downloader_opts)
-            dl.download([video_url])
+            dl = get_downloader()
+            started, retries = time.monotonic(), retry_count()
+            info = ytdlp_call("youtube", lambda: dl.extract_info(video_url, download=False), label=video_url)
+            emit_metric("extract", platform="youtube", id=info.get('id'), seconds=round(time.monotonic() - started, 3),
+                        retries=retry_count() - retries)
+            # tek video olarak çözüldüğü için playlist alanlarını biz dolduruyoruz (outtmpl bunlara bakıyor)
+            info['playlist_title'] = playlist_info.get('title')
+            info['playlist_index'] = idx
+            media_id = info.get('id') or archive_id
+            target = dl.prepare_filename(info)
+            owner = claim_output_path(target, media_id)
+            if owner == media_id:
+                log(f"[{idx}/{total}] Video playlist'te tekrar ediyor, atlanıyor: {video_url}")
+                return "skipped"
+            if owner is None:
+                owner = finished_output_owner(target)
+                if owner is not None and owner != media_id:
+                    release_output_path(target)
+            if owner is not None and owner != media_id:
+                # başka bir video aynı başlığı kullanıyor: Coub'daki gibi "başlık [id]" adıyla kaydedilir
+                info['title'] = f"{info.get('title')} [{media_id}]"
+                target = dl.prepare_filename(info)
+                log(f"[{idx}/{total}] Aynı başlıklı başka bir video var, şu adla kaydediliyor: {target}",
+                    [f"DUPLICATE-OUTPUT: {video_url}", f"Path: {target}"])
+                if claim_output_path(target, media_id) is not None:
+                    log(f"[{idx}/{total}] Video playlist'te tekrar ediyor, atlanıyor: {video_url}")
+                    return "skipped"
+            released = False
+            try:
+                converted = os.path.splitext(target)[0] + ".mp3"
+                if file_format == "mp3" and os.path.exists(converted):
+                    # önceki çalışmanın mp3'ü duruyor: kaynak tekrar indirilip dönüşümde silinmesin
+                    log(f"[{idx}/{total}] Zaten mp3 olarak var, atlanıyor: {converted}")
+                    owners.add("youtube", media_id, path=converted)
+                    return "skipped"
+                # extract_info sonucu doğrudan indirmeye veriliyor, ikinci kez extraction yapılmıyor
+                started, retries = time.monotonic(), retry_count()
+                info = ytdlp_call("youtube", lambda: dl.process_ie_result(info, download=True), label=video_url)
+                emit_download("youtube", info.get('id'), downloaded_filepath(info), time.monotonic() - started,
+                              file_size(downloaded_filepath(info)), retry_count() - retries)
+                on_done = lambda path: owners.add("youtube", media_id, path=path)
+                future = queue_postprocessing(postprocessor, info, file_format, on_done=on_done)
+                if future is not None:
+                    # claim arşive yazılana kadar (dönüşüm bitene kadar) tutulur
+                    future.add_done_callback(lambda _, path=target: release_output_path(path))
+                    released = True
+                return "done"
+            finally:
+                if not released:
+                    release_output_path(target)
         except Exception as e:
-            with open(debug_file, "a", encoding="utf-8") as f:
-                f.write(f"[{datetime.now(timezone.utc).isoformat()}] VIDEO-ERROR: {video_url}\n")
-                f.write(f"Flat-title (if present): {entry.get('title')}\n")
-                f.write(f"Error: {str(e)}\n")
-                f.write(traceback.format_exc() + "\n\n")
-            print(f"[{idx}/{total}] Hata: {e}. Detaylar {debug_file} dosyasına yazıldı. Devam ediliyor.")
-            continue
+            log(f"[{idx}/{total}] Hata: {e}. Detaylar {debug_file} dosyasına yazıldı. Devam ediliyor.",
+                [f"VIDEO-ERROR: {video_url}",
+                 f"Flat-title (if present): {entry.get('title')}",
+                 f"Error: {str(e)}",
+                 traceback.format_exc()])
+            return "failed"
+
+    # entry'ler sınırlı bir worker havuzuna dağıtılır (--jobs); bekleyen iş sayısı da sınırlı,
+    # böylece listeleme indirmelerin çok önüne geçip belleği doldurmaz
+    slots = threading.BoundedSemaphore(jobs * 2)
+
+    def run_entry(idx, entry):
+        try:
+            download_entry(idx, entry)
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for idx, entry in enumerate(entries, start=1):
+            if state.is_done(idx):
+                continue
+            slots.acquire()
+            pool.submit(run_entry, idx, entry)
+
+    for dl in downloaders:
+        dl.close()
+    if own_postprocessor:
+        postprocessor.close()
+    if owners is not archive:
+        owners.close()
+        shutil.rmtree(owners_dir, ignore_errors=True)
 
     print("İndirme işlemi tamamlandı.")
+    state.finish()
 
 # ----------------- INSTAGRAM -----------------
 # --------- UPDATED Instagram bookmarks downloader ----------
 
-def download_instagram_url(url, out_folder="instagram_videos", format_preference="mp4"):
-    """
-    Downloads with yt_dlp (public post/igtv/reel).
-    format_preference: "mp4" or "mp3"
-    """
-    import yt_dlp
-    os.makedirs(out_folder, exist_ok=True)
-
+def instagram_url_opts(format_preference="mp4", out_folder="instagram_videos"):
+    """yt-dlp options of a single Instagram URL download."""
     if format_preference == "mp3":
-        ydl_opts = {
+        return {
             'format': 'bestaudio/best',
             'outtmpl': os.path.join(out_folder, '%(title)s.%(ext)s'),
+            'final_ext': 'mp3',
             'quiet': False,
             'nooverwrites': True,
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
-        }
-    else:
-        ydl_opts = {
-            'format': 'best[ext=mp4]/best',
-            'outtmpl': os.path.join(out_folder, '%(title)s.%(ext)s'),
-            'quiet': False,
-            'nooverwrites': True,
-            'merge_output_format': 'mp4',
+            **ytdlp_transfer_opts(out_folder),
         }
+    return {
+        'format': 'best[ext=mp4]/best',
+        'outtmpl': os.path.join(out_folder, '%(title)s.%(ext)s'),
+        'quiet': False,
+        'nooverwrites': True,
+        'merge_output_format': 'mp4',
+        **ytdlp_transfer_opts(out_folder),
+    }
 
-    try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([url])
+def download_instagram_url(url, out_folder="instagram_videos", format_preference="mp4", archive=None,
+                           postprocessor=None, ydl=None):
+    """
+    Downloads with yt_dlp (public post/igtv/reel).
+    format_preference: "mp4" or "mp3"
+    ydl: optional reusable YoutubeDL built from instagram_url_opts()
+    """
+    import yt_dlp
+    shortcode = instagram_shortcode(url)
+    if archive is not None and archive.has("instagram", shortcode):
+        print(f"Skipped (In archive): instagram {shortcode}")
         return True
+    os.makedirs(out_folder, exist_ok=True)
+
+    started, retries = time.monotonic(), retry_count()
+    try:
+        if ydl is None:
+            with yt_dlp.YoutubeDL(instagram_url_opts(format_preference, out_folder)) as own_ydl:
+                info = ytdlp_call("instagram", lambda: own_ydl.extract_info(url, download=True), label=url)
+        else:
+            info = ytdlp_call("instagram", lambda: ydl.extract_info(url, download=True), label=url)
     except Exception as e:
         print(f"YT-DLP hata ({url}): {e}")
+        emit_download("instagram", shortcode, None, time.monotonic() - started, None, retry_count() - retries,
+                      status="failed", url=url)
         return False
+    media_id = shortcode or (info or {}).get('id')
+    emit_download("instagram", media_id, downloaded_filepath(info), time.monotonic() - started,
+                  file_size(downloaded_filepath(info)), retry_count() - retries, url=url)
+    if format_preference == "mp3":
+        own_postprocessor = postprocessor is None
+        if own_postprocessor:
+            postprocessor = PostProcessQueue()
+        on_done = (lambda path: archive.add("instagram", media_id, path=path)) if archive is not None else None
+        queue_postprocessing(postprocessor, info, "mp3", on_done=on_done)
+        if own_postprocessor:
+            postprocessor.close()
+    elif archive is not None:
+        archive.add("instagram", media_id, path=downloaded_filepath(info))
+    return True
+
+INSTAGRAM_PHOTO_EXTS = ("jpg", "jpeg", "png", "webp", "heic")
 
-def download_instagram_from_file(txt_path, out_folder="instagram_videos", format_preference="mp4", cookies_file=None):
+def download_instagram_from_file(txt_path, out_folder="instagram_videos", format_preference="mp4", cookies_file=None,
+                                 archive=None, resume=False, postprocessor=None):
     """
     Downloads all videos that indicated per line.
+    Every URL is extracted exactly once: the probe result is handed to
+    process_ie_result, and the video/photo choice is made from it.
     """
     import yt_dlp
     if not os.path.isfile(txt_path):
@@ -245,202 +2296,560 @@ def download_instagram_from_file(txt_path, out_folder="instagram_videos", format
 
     os.makedirs(out_folder, exist_ok=True)
 
-    with open(txt_path, "r", encoding="utf-8") as fh:
-        lines = fh.readlines()
-
     total_urls = 0
     succeeded_urls = 0
     total_items_downloaded = 0
+    state = JobState.open(out_folder, "instagram-file", os.path.abspath(txt_path), resume, sequential=True)
+    own_postprocessor = postprocessor is None
+    if own_postprocessor:
+        postprocessor = PostProcessQueue()
+
+    # 'snapstream_prefix' satır numarasını (carousel'de öğe sırasını da) taşır,
+    # böylece aynı YoutubeDL örnekleri tüm URL'ler için tekrar kullanılabilir
+    base_opts = {
+        "outtmpl": os.path.join(out_folder, "%(snapstream_prefix)s-%(id)s-%(title)s.%(ext)s"),
+        "noplaylist": True,
+        "cookiefile": cookies_file if cookies_file else None,
+        "quiet": False,
+        "nooverwrites": False,
+        **ytdlp_transfer_opts(out_folder),
+    }
+    if format_preference == "mp3":
+        ydl_main = yt_dlp.YoutubeDL({**base_opts, "format": "bestaudio/best", "final_ext": "mp3"})
+        ydl_photo = None
+    else:
+        ydl_main = yt_dlp.YoutubeDL({
+            **base_opts,
+            "format": "bestaudio*+bestvideo* / best",
+            "postprocessors": [],
+            "merge_output_format": "mp4",
+        })
+        ydl_photo = yt_dlp.YoutubeDL({**base_opts, "format": "bestphoto"})
 
-    for index, raw in enumerate(lines, start=1):
-        line = raw.strip()
+    def log_error(err_msg):
+        print(err_msg)
+        with open("error_log_01.txt", "a", encoding="utf-8") as f:
+            f.write(err_msg + "\n")
+
+    def process(ydl, item):
+        # format seçimi dict'i değiştirdiği için her deneme temiz bir kopya alır
+        started, retries = time.monotonic(), retry_count()
+        result = ytdlp_call("instagram", lambda: ydl.process_ie_result(dict(item), download=True),
+                            label=item.get('webpage_url') or item.get('id') or "")
+        emit_download("instagram", result.get('id'), downloaded_filepath(result), time.monotonic() - started,
+                      file_size(downloaded_filepath(result)), retry_count() - retries)
+        return result
+
+    def download_item(item, prefix):
+        """Downloads an already extracted item; video first, photo as fallback."""
+        item['snapstream_prefix'] = prefix
+        if ydl_photo is None:
+            queue_postprocessing(postprocessor, process(ydl_main, item), "mp3")
+            return
+        is_video = (item.get('_type') in ('url', 'url_transparent')
+                    or item.get('is_video') is True or bool(item.get('formats'))
+                    or (bool(item.get('url')) and item.get('ext') not in INSTAGRAM_PHOTO_EXTS))
+        if not is_video:
+            process(ydl_photo, item)
+            return
+        try:
+            process(ydl_main, item)
+        except Exception as e_video:
+            print(f"[{prefix}] Video Download Fail: {e_video}")
+            try:
+                process(ydl_photo, item)
+            except Exception as e_photo:
+                raise Exception(f"video_err={e_video} | photo_err={e_photo}")
+
+    for index, line in iter_lines(txt_path):
         if not line or line.startswith("#"):
+            state.mark(index, "skipped")
             continue
         if not re.match(r'https?://', line):
             print(f"[{index:02d}] Skipped (invalid URL): {line}")
+            state.mark(index, "skipped")
             continue
 
         total_urls += 1
+        if state.is_done(index):
+            succeeded_urls += 1
+            continue
+        shortcode = instagram_shortcode(line)
+        if archive is not None and archive.has("instagram", shortcode):
+            print(f"[{index:02d}] Skipped (In archive): {line}")
+            state.mark(index, "skipped")
+            succeeded_urls += 1
+            continue
         print(f"[{index:02d}] Process: {line}")
 
-        # İlk olarak metadata çıkaralım
-        ydl_probe_opts = {
-            'quiet': True,
-            'skip_download': True,
-        }
-        if cookies_file:
-            ydl_probe_opts['cookiefile'] = cookies_file
+        items_downloaded_for_url = 0
+        carousel_failed = False
+        item_started, item_retries = time.monotonic(), retry_count()
 
         try:
-            with yt_dlp.YoutubeDL(ydl_probe_opts) as ydl_probe:
-                info = None
-                try:
-                    info = ydl_probe.extract_info(line, download=False)
-                except Exception as e:
-                    info = None
-
-            items_downloaded_for_url = 0
+            # tek probe: format seçimi yapılmadan ham metadata alınır
+            try:
+                info = ytdlp_call("instagram", lambda: ydl_main.extract_info(line, download=False, process=False),
+                                  label=line)
+            except Exception as e:
+                log_error(f"[{index:02d}] Probe Fail ({line}): {e}")
+                state.mark(index, "failed")
+                emit_metric("item", platform="instagram", index=index, id=shortcode, status="failed",
+                            seconds=round(time.monotonic() - item_started, 3), retries=retry_count() - item_retries)
+                continue
+            emit_metric("extract", platform="instagram", id=shortcode or info.get('id'),
+                        seconds=round(time.monotonic() - item_started, 3), retries=retry_count() - item_retries)
 
             if isinstance(info, dict) and info.get('entries'):
-                entries = list(info.get('entries') or [])
+                # carousel öğeleri extractor ürettikçe indirilir, liste belleğe alınmaz
+                entries = info.get('entries') or []
+                playlist_extra = {
+                    'playlist': info.get('title') or info.get('id'),
+                    'playlist_id': info.get('id'),
+                    'playlist_title': info.get('title'),
+                    'playlist_count': info.get('playlist_count') or (len(entries) if isinstance(entries, list) else None),
+                    'webpage_url': info.get('webpage_url') or line,
+                    'original_url': line,
+                    'extractor': info.get('extractor'),
+                    'extractor_key': info.get('extractor_key'),
+                }
                 for e_index, entry in enumerate(entries, start=1):
                     if not isinstance(entry, dict):
                         continue
-                    entry_url = entry.get('webpage_url') or entry.get('original_url') or entry.get('url')
-                    if not entry_url:
-                        continue
-
-                    is_video = False
-                    if entry.get('is_video') is True:
-                        is_video = True
-                    elif entry.get('formats'):
-                        is_video = True
-                    elif entry.get('thumbnails') and not entry.get('formats'):
-                        is_video = False
-
-                    outtmpl = os.path.join(out_folder, f"{index:02d}-%(playlist_index)s-%(id)s-%(title)s.%(ext)s")
-
-                    if format_preference == "mp3":
-                        ydl_opts = {
-                            "outtmpl": outtmpl,
-                            "noplaylist": True,
-                            "cookiefile": cookies_file if cookies_file else None,
-                            "format": "bestaudio/best",
-                            "postprocessors": [{
-                                "key": "FFmpegExtractAudio",
-                                "preferredcodec": "mp3",
-                                "preferredquality": "192",
-                            }],
-                            "quiet": False,
-                            "nooverwrites": False,
-                        }
-                    else:
-                        fmt = "bestaudio*+bestvideo* / best" if is_video else "bestphoto"
-                        ydl_opts = {
-                            "outtmpl": outtmpl,
-                            "noplaylist": True,
-                            "cookiefile": cookies_file if cookies_file else None,
-                            "format": fmt,
-                            "quiet": False,
-                            "nooverwrites": False,
-                            "postprocessors": [],
-                            "merge_output_format": "mp4",
-                        }
-
+                    entry_url = entry.get('webpage_url') or entry.get('original_url') or entry.get('url') or line
+                    yt_dlp.YoutubeDL.add_extra_info(entry, {**playlist_extra, 'playlist_index': e_index})
                     try:
-                        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                            print(f"  -> Downloading Carousel ({e_index}/{len(entries)}): {entry_url}")
-                            ydl.download([entry_url])
+                        print(f"  -> Downloading Carousel ({e_index}/{playlist_extra['playlist_count'] or '?'}): {entry_url}")
+                        download_item(entry, f"{index:02d}-{e_index}")
                         items_downloaded_for_url += 1
                         total_items_downloaded += 1
                     except Exception as e:
-                        err_msg = f"[{index:02d}] Carousel Download Fail ({entry_url}): {e}"
-                        print(err_msg)
-                        with open("error_log_01.txt", "a", encoding="utf-8") as f:
-                            f.write(err_msg + "\n")
-                if items_downloaded_for_url > 0:
-                    succeeded_urls += 1
-
+                        carousel_failed = True
+                        log_error(f"[{index:02d}] Carousel Download Fail ({entry_url}): {e}")
             else:
-                is_video = False
-                if isinstance(info, dict):
-                    if info.get('is_video') is True or info.get('formats'):
-                        is_video = True
-                    elif info.get('thumbnails') and not info.get('formats'):
-                        is_video = False
-
-                outtmpl = os.path.join(out_folder, f"{index:02d}-%(id)s-%(title)s.%(ext)s")
-
-                tried_video_first = False
-                did_download = False
-
-                if format_preference == "mp3":
-                    ydl_opts = {
-                        "outtmpl": outtmpl,
-                        "noplaylist": True,
-                        "cookiefile": cookies_file if cookies_file else None,
-                        "format": "bestaudio/best",
-                        "postprocessors": [{
-                            "key": "FFmpegExtractAudio",
-                            "preferredcodec": "mp3",
-                            "preferredquality": "192",
-                        }],
-                        "quiet": False,
-                        "nooverwrites": False,
-                    }
-                    try:
-                        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                            ydl.download([line])
-                        did_download = True
-                        items_downloaded_for_url += 1
-                        total_items_downloaded += 1
-                    except Exception as e:
-                        err_msg = f"[{index:02d}] MP3 Download Fail ({line}): {e}"
-                        print(err_msg)
-                        with open("error_log_01.txt", "a", encoding="utf-8") as f:
-                            f.write(err_msg + "\n")
-                else:
-                    video_fmt = "bestaudio*+bestvideo* / best"
-                    photo_fmt = "bestphoto"
-                    tried_video_first = True
-                    ydl_opts_video = {
-                        "outtmpl": outtmpl,
-                        "noplaylist": True,
-                        "cookiefile": cookies_file if cookies_file else None,
-                        "format": video_fmt,
-                        "quiet": False,
-                        "nooverwrites": False,
-                        "postprocessors": [],
-                        "merge_output_format": "mp4",
-                    }
-                    try:
-                        with yt_dlp.YoutubeDL(ydl_opts_video) as ydl:
-                            ydl.download([line])
-                        did_download = True
-                        items_downloaded_for_url += 1
-                        total_items_downloaded += 1
-                    except Exception as e_video:
-                        print(f"[{index:02d}] Video Download Fail: {e_video}")
-                        ydl_opts_photo = {
-                            "outtmpl": outtmpl,
-                            "noplaylist": True,
-                            "cookiefile": cookies_file if cookies_file else None,
-                            "format": photo_fmt,
-                            "quiet": False,
-                            "nooverwrites": False,
-                        }
-                        try:
-                            with yt_dlp.YoutubeDL(ydl_opts_photo) as ydl:
-                                ydl.download([line])
-                            did_download = True
-                            items_downloaded_for_url += 1
-                            total_items_downloaded += 1
-                        except Exception as e_photo:
-                            err_msg = f"[{index:02d}] VIDEO/IMG FAIL ({line}): video_err={e_video} | photo_err={e_photo}"
-                            print(err_msg)
-                            with open("error_log_01.txt", "a", encoding="utf-8") as f:
-                                f.write(err_msg + "\n")
-
-                if did_download:
-                    succeeded_urls += 1
+                try:
+                    download_item(info, f"{index:02d}")
+                    items_downloaded_for_url += 1
+                    total_items_downloaded += 1
+                except Exception as e:
+                    kind = "MP3 Download Fail" if format_preference == "mp3" else "VIDEO/IMG FAIL"
+                    log_error(f"[{index:02d}] {kind} ({line}): {e}")
+
+            if items_downloaded_for_url > 0:
+                succeeded_urls += 1
 
         except Exception as e_outer:
-            err_msg = f"[{index:02d}] Error! ({line}): {e_outer}"
-            print(err_msg)
-            with open("error_log_01.txt", "a", encoding="utf-8") as f:
-                f.write(err_msg + "\n")
+            log_error(f"[{index:02d}] Error! ({line}): {e_outer}")
+            state.mark(index, "failed")
+            emit_metric("item", platform="instagram", index=index, id=shortcode, status="failed",
+                        seconds=round(time.monotonic() - item_started, 3), retries=retry_count() - item_retries)
             continue
 
         print(f"[{index:02d}] Download Count: {items_downloaded_for_url}")
+        status = "done" if items_downloaded_for_url > 0 and not carousel_failed else "failed"
+        state.mark(index, status)
+        emit_metric("item", platform="instagram", index=index, id=shortcode or info.get('id'), status=status,
+                    items=items_downloaded_for_url, seconds=round(time.monotonic() - item_started, 3),
+                    retries=retry_count() - item_retries)
 
-        time.sleep(1)
+        if archive is not None and items_downloaded_for_url > 0 and not carousel_failed:
+            archive.add("instagram", shortcode or info.get('id'))
+
+    ydl_main.close()
+    if ydl_photo is not None:
+        ydl_photo.close()
+    if own_postprocessor:
+        postprocessor.close()
 
     print(f"Completed: {succeeded_urls}/{total_urls} Downloaded, County: {total_items_downloaded}")
+    state.finish()
 
 # ----------------- Instagram bookmarks -----------------
 # def download_instagram_bookmarks(sessionid, ds_user_id, csrftoken, user_agent):
     # soon
 
+# ----------------- BATCH -----------------
+BATCH_LIMITS = {"youtube": 2, "instagram": 1, "coub": 4}  # platform başına eşzamanlı indirme
+BATCH_BACKLOG = 50  # platform kuyruğunda bekleyebilecek URL sayısı
+
+def classify_url(url):
+    """Job kind of a URL: "youtube", "youtube-playlist", "instagram", "coub" or None."""
+    host = urllib.parse.urlparse(url).netloc.lower()
+    if host.endswith("youtube.com") or host.endswith("youtu.be"):
+        return "youtube" if youtube_video_id(url) else "youtube-playlist"
+    if host.endswith("instagram.com"):
+        return "instagram"
+    if host.endswith("coub.com"):
+        return "coub"
+    return None
+
+class BatchScheduler:
+    """
+    Runs URLs of every platform in one process. Each platform has its own
+    bounded queue and `limits[platform]` worker threads, so a slow platform
+    never holds the slots of another, while requests still share the
+    per-platform rate limiters. Each worker thread keeps its YoutubeDL.
+    submit() blocks while the platform's queue is full.
+    """
+
+    def __init__(self, file_format="mp4", limits=None, archive=None, cache=None, postprocessor=None,
+                 resume=False, backlog=BATCH_BACKLOG, chunk_size=DEFAULT_CHUNK_SIZE):
+        import queue
+        self.file_format = file_format
+        self.limits = {**BATCH_LIMITS, **(limits or {})}
+        self.archive = archive
+        self.cache = cache
+        self.postprocessor = postprocessor
+        self.resume = resume
+        self.chunk_size = chunk_size
+        self.stats = {"done": 0, "failed": 0, "cancelled": 0}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._queues = {platform: queue.Queue(maxsize=max(1, backlog)) for platform in self.limits}
+        self._workers = []
+        for platform, count in self.limits.items():
+            for i in range(max(1, count)):
+                worker = threading.Thread(target=self._work, args=(platform,), name=f"batch-{platform}-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def submit(self, url, on_done=None, on_start=None):
+        """
+        Queues url; on_done(status) runs with "done", "failed" or "cancelled".
+        on_start() is asked right before the download and may return False
+        to drop the job. Returns the job kind, None if unsupported.
+        """
+        kind = classify_url(url)
+        if kind is None:
+            return None
+        self._queues[kind.split("-")[0]].put((kind, url, on_done, on_start))
+        return kind
+
+    def _ydl(self, platform):
+        import yt_dlp
+        ydl = getattr(self._local, platform, None)
+        if ydl is None:
+            opts = youtube_video_opts(self.file_format) if platform == "youtube" else instagram_url_opts(self.file_format)
+            ydl = yt_dlp.YoutubeDL(opts)
+            setattr(self._local, platform, ydl)
+        return ydl
+
+    def _run(self, kind, url):
+        if kind == "youtube-playlist":
+            download_youtube_playlist(url, file_format=self.file_format, archive=self.archive, resume=self.resume,
+                                      cache=self.cache, postprocessor=self.postprocessor)
+            return True
+        if kind == "youtube":
+            return download_youtube_video(url, file_format=self.file_format, archive=self.archive,
+                                          postprocessor=self.postprocessor, ydl=self._ydl("youtube"))
+        if kind == "instagram":
+            return download_instagram_url(url, format_preference=self.file_format, archive=self.archive,
+                                          postprocessor=self.postprocessor, ydl=self._ydl("instagram"))
+        return download_coub(url, archive=self.archive, chunk_size=self.chunk_size)
+
+    def _work(self, platform):
+        jobs = self._queues[platform]
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            kind, url, on_done, on_start = job
+            if on_start is not None and not on_start():
+                status = "cancelled"
+            else:
+                try:
+                    ok = self._run(kind, url)
+                except Exception as e:
+                    print(f"Fail ({url}): {e}")
+                    ok = False
+                status = "done" if ok else "failed"
+            with self._lock:
+                self.stats[status] += 1
+            if on_done is not None:
+                on_done(status)
+        for name in ("youtube", "instagram"):
+            ydl = getattr(self._local, name, None)
+            if ydl is not None:
+                ydl.close()
+
+    def close(self):
+        """Lets the workers drain their queues and waits for them."""
+        for platform, count in self.limits.items():
+            for _ in range(max(1, count)):
+                self._queues[platform].put(None)
+        for worker in self._workers:
+            worker.join()
+
+def run_batch(manifest_path, file_format="mp4", limits=None, archive=None, resume=False, cache=None,
+              postprocessor=None):
+    """
+    Downloads every URL of a mixed YouTube/Instagram/Coub manifest (one per
+    line, # for comments) through one BatchScheduler. Every platform has
+    its own feeder thread that reads the file line by line and submits
+    only its own URLs, so a long run of YouTube lines never leaves the
+    Coub/Instagram workers idle. Progress is checkpointed per platform,
+    keyed by the n-th URL of that platform in the file.
+    """
+    if not os.path.isfile(manifest_path):
+        print("Dosya bulunamadı:", manifest_path)
+        return
+    manifest_path = os.path.abspath(manifest_path)
+    own_postprocessor = postprocessor is None
+    if own_postprocessor:
+        postprocessor = PostProcessQueue()
+    scheduler = BatchScheduler(file_format, limits=limits, archive=archive, cache=cache,
+                               postprocessor=postprocessor, resume=resume)
+    platforms = list(scheduler.limits)
+    # platform başına ayrı checkpoint: watermark yalnızca o platformun işlerini bekler
+    states = {platform: JobState.open(os.path.dirname(manifest_path), f"batch-{platform}", manifest_path, resume,
+                                      sequential=True)
+              for platform in platforms}
+    totals = {"queued": 0, "already_done": 0, "unsupported": 0}
+    totals_lock = threading.Lock()
+
+    def feed(platform):
+        state = states[platform]
+        counts = dict.fromkeys(totals, 0)
+        ordinal = 0
+        for index, url in iter_lines(manifest_path):
+            if not url or url.startswith("#"):
+                continue
+            kind = classify_url(url)
+            if kind is None:
+                if platform == platforms[0]:  # desteklenmeyen satırları tek bir feeder raporlar
+                    print(f"[{index:02d}] Skipped (unsupported URL): {url}")
+                    counts["unsupported"] += 1
+                continue
+            if kind.split("-")[0] != platform:
+                continue
+            ordinal += 1
+            if state.is_done(ordinal):
+                counts["already_done"] += 1
+                continue
+            # kuyruk doluysa yalnızca bu platformun feeder'ı bekler
+            scheduler.submit(url, on_done=lambda status, ordinal=ordinal: state.mark(ordinal, status))
+            counts["queued"] += 1
+        with totals_lock:
+            for key, value in counts.items():
+                totals[key] += value
+
+    feeders = [threading.Thread(target=feed, args=(platform,), name=f"batch-feed-{platform}", daemon=True)
+               for platform in platforms]
+    for feeder in feeders:
+        feeder.start()
+    for feeder in feeders:
+        feeder.join()
+    scheduler.close()
+    if own_postprocessor:
+        postprocessor.close()
+    print(f"Batch completed: {scheduler.stats['done']}/{totals['queued']} Downloaded, {scheduler.stats['failed']} failed, "
+          f"{totals['already_done']} already done, {totals['unsupported']} unsupported")
+    for state in states.values():
+        state.finish()
+
+# ----------------- SERVE -----------------
+DEFAULT_SERVE_PORT = 8787
+SERVE_HISTORY = 10000  # hafızada tutulan bitmiş iş sayısı
+
+class JobQueue:
+    """
+    Jobs submitted to the daemon. add() only records the job and returns;
+    one dispatcher thread per platform feeds the BatchScheduler, so HTTP
+    clients never wait on a full platform queue and a full YouTube queue
+    does not hold back Instagram/Coub jobs. Queued jobs can be cancelled until a
+    worker picks them up. Only the newest `history` finished jobs are kept.
+    """
+
+    FINISHED = ("done", "failed", "cancelled")
+
+    def __init__(self, scheduler, history=SERVE_HISTORY):
+        import collections
+        import itertools
+        import queue
+        self.scheduler = scheduler
+        self.history = history
+        self._jobs = collections.OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._pending = {platform: queue.Queue() for platform in scheduler.limits}
+        self._dispatchers = [threading.Thread(target=self._dispatch, args=(platform,), name=f"serve-dispatch-{platform}",
+                                              daemon=True)
+                             for platform in self._pending]
+        for dispatcher in self._dispatchers:
+            dispatcher.start()
+
+    def add(self, url):
+        """Records a job for url and returns it, or None when the URL is not supported."""
+        kind = classify_url(url)
+        if kind is None:
+            return None
+        with self._lock:
+            job = {"id": str(next(self._ids)), "url": url, "kind": kind, "status": "queued",
+                   "created_at": time.time(), "started_at": None, "finished_at": None}
+            self._jobs[job["id"]] = job
+            if len(self._jobs) > self.history:
+                finished = [k for k, v in self._jobs.items() if v["status"] in self.FINISHED]
+                for job_id in finished[:len(self._jobs) - self.history]:
+                    del self._jobs[job_id]
+        self._pending[kind.split("-")[0]].put(job)
+        return dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list(self, status=None):
+        with self._lock:
+            return [dict(job) for job in self._jobs.values() if status is None or job["status"] == status]
+
+    def counts(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+            return counts
+
+    def cancel(self, job_id):
+        """Cancels a queued job; running and finished jobs are returned unchanged."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job["status"] == "queued":
+                job["status"] = "cancelled"
+                job["finished_at"] = time.time()
+            return dict(job)
+
+    def _start(self, job):
+        with self._lock:
+            if job["status"] != "queued":
+                return False
+            job["status"] = "running"
+            job["started_at"] = time.time()
+            return True
+
+    def _finish(self, job, status):
+        with self._lock:
+            if job["status"] == "running":
+                job["status"] = status
+                job["finished_at"] = time.time()
+
+    def _dispatch(self, platform):
+        pending = self._pending[platform]
+        while True:
+            job = pending.get()
+            if job is None:
+                return
+            if job["status"] != "queued":
+                continue
+            self.scheduler.submit(job["url"], on_done=lambda status, job=job: self._finish(job, status),
+                                  on_start=lambda job=job: self._start(job))
+
+    def close(self):
+        """Cancels everything still queued and waits for running downloads."""
+        with self._lock:
+            for job in self._jobs.values():
+                if job["status"] == "queued":
+                    job["status"] = "cancelled"
+                    job["finished_at"] = time.time()
+        for pending in self._pending.values():
+            pending.put(None)
+        for dispatcher in self._dispatchers:
+            dispatcher.join()
+        self.scheduler.close()
+
+def serve(host="127.0.0.1", port=DEFAULT_SERVE_PORT, file_format="mp4", limits=None, archive=None, cache=None,
+          postprocessor=None):
+    """
+    Long-running daemon with a small JSON API on host:port:
+      POST   /jobs          {"url": ...} or {"urls": [...]} -> queued jobs
+      GET    /jobs          all jobs (?status=queued|running|done|failed|cancelled)
+      GET    /jobs/<id>     one job
+      DELETE /jobs/<id>     cancel a queued job
+    yt-dlp, the HTTP pool, the archive and the cache stay loaded between jobs.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    own_postprocessor = postprocessor is None
+    if own_postprocessor:
+        postprocessor = PostProcessQueue()
+    scheduler = BatchScheduler(file_format, limits=limits, archive=archive, cache=cache, postprocessor=postprocessor)
+    jobs = JobQueue(scheduler)
+
+    class Handler(BaseHTTPRequestHandler):
+        def reply(self, code, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def route(self):
+            parsed = urllib.parse.urlparse(self.path)
+            m = re.fullmatch(r'/jobs(?:/([0-9]+))?/?', parsed.path)
+            return (True, m.group(1), urllib.parse.parse_qs(parsed.query)) if m else (False, None, {})
+
+        def do_GET(self):
+            ok, job_id, query = self.route()
+            if not ok:
+                return self.reply(404, {"error": "not found"})
+            if job_id is None:
+                status = (query.get("status") or [None])[0]
+                return self.reply(200, {"jobs": jobs.list(status), "counts": jobs.counts()})
+            job = jobs.get(job_id)
+            return self.reply(200, job) if job else self.reply(404, {"error": f"no job {job_id}"})
+
+        def do_POST(self):
+            ok, job_id, _ = self.route()
+            if not ok or job_id is not None:
+                return self.reply(404, {"error": "not found"})
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                urls = body.get("urls") or ([body["url"]] if body.get("url") else [])
+            except (ValueError, AttributeError):
+                return self.reply(400, {"error": "expected a JSON object"})
+            if not urls:
+                return self.reply(400, {"error": "url or urls is required"})
+            # {"urls": "https://..."} harf harf bölünmesin
+            if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+                return self.reply(400, {"error": "url must be a string and urls a list of strings"})
+            queued, unsupported = [], []
+            for url in urls:
+                job = jobs.add(str(url).strip())
+                if job:
+                    queued.append(job)
+                else:
+                    unsupported.append(url)
+            return self.reply(202 if queued else 400, {"jobs": queued, "unsupported": unsupported})
+
+        def do_DELETE(self):
+            ok, job_id, _ = self.route()
+            if not ok or job_id is None:
+                return self.reply(404, {"error": "not found"})
+            job = jobs.cancel(job_id)
+            if job is None:
+                return self.reply(404, {"error": f"no job {job_id}"})
+            if job["status"] != "cancelled":
+                return self.reply(409, {"error": f"job is {job['status']}", "job": job})
+            return self.reply(200, job)
+
+        def log_message(self, format, *args):
+            pass  # indirme çıktısı zaten konsolda
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    print(f"Serving on http://{host}:{port} (POST /jobs, GET /jobs/<id>, DELETE /jobs/<id>); Ctrl+C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopping: queued jobs are cancelled, running downloads finish first...")
+    finally:
+        server.server_close()
+        jobs.close()
+        if own_postprocessor:
+            postprocessor.close()
+
 # ----------------- CLI -----------------
 if __name__ == "__main__":
         parser = argparse.ArgumentParser(
@@ -459,6 +2868,9 @@ USAGE:
     Download YouTube playlist as audio (mp3):
         python coubyuinst.py youtube-playlist --url "https://youtube.com/playlist?list=..." --format mp3
 
+    Download YouTube playlist with 4 parallel downloads:
+        python coubyuinst.py youtube-playlist --url "https://youtube.com/playlist?list=..." --jobs 4
+
     Download Instagram video:
         python coubyuinst.py instagram-download --url "https://www.instagram.com/p/XXXX/" 
 
@@ -467,52 +2879,162 @@ USAGE:
 
     Download Coub liked videos:
         python coubyuinst.py coub-likes --session <COUB_SESSION> --token <REMEMBER_TOKEN>
+
+    Download a mixed YouTube/Instagram/Coub URL list in one process:
+        python coubyuinst.py batch --file urls.txt --limit youtube=4
+
+    Cap total bandwidth at 20 MiB/s and keep 5 GiB of disk free:
+        python coubyuinst.py batch --file urls.txt --bandwidth 20M --min-free 5G
+
+    Run as a local daemon and submit jobs over HTTP:
+        python coubyuinst.py serve --port 8787
+        curl -X POST localhost:8787/jobs -d '{"url": "https://youtube.com/watch?v=..."}'
                 """,
                 formatter_class=argparse.RawDescriptionHelpFormatter
         )
 
         subparsers = parser.add_subparsers(dest="command", required=True)
 
+        # options shared by every subcommand
+        common = argparse.ArgumentParser(add_help=False)
+        common.add_argument("--archive", default=DEFAULT_ARCHIVE, help=f"download archive database (default {DEFAULT_ARCHIVE})")
+        common.add_argument("--no-archive", action="store_true", help="do not read or update the download archive")
+        common.add_argument("--cache", default=DEFAULT_CACHE, help=f"listing cache database (default {DEFAULT_CACHE})")
+        common.add_argument("--cache-ttl", type=float, default=DEFAULT_CACHE_TTL / 3600,
+                            help="hours a cached playlist/Coub listing is reused by --incremental runs without re-listing (default 12)")
+        common.add_argument("--no-cache", action="store_true", help="do not read or update the listing cache")
+        common.add_argument("--ffmpeg-workers", type=int, default=None,
+                            help="parallel FFmpeg conversions (default: number of CPU cores)")
+        common.add_argument("--rate", action="append", default=[], metavar="PLATFORM=REQ_PER_S",
+                            help="request rate ceiling for a platform or host, e.g. instagram=2 (repeatable)")
+        common.add_argument("--retries", type=int, default=DEFAULT_RETRIES, help=f"retries for transient failures (default {DEFAULT_RETRIES})")
+        common.add_argument("--bandwidth", type=parse_size, default=None, metavar="RATE",
+                            help="total download rate of all transfers together in bytes/s, e.g. 20M (default unlimited)")
+        common.add_argument("--min-free", type=parse_size, default=DEFAULT_MIN_FREE, metavar="SIZE",
+                            help="free disk space every download must leave, e.g. 2G; downloads wait or fail "
+                                 f"instead of going below it (default {DEFAULT_MIN_FREE // 2**20}M)")
+        common.add_argument("--metrics", metavar="FILE", help="append per-item timing events and a run summary to FILE (JSON lines)")
+
         # YouTube video
-        yt_video = subparsers.add_parser("youtube-video", help="Download YouTube video (maks 1080p)")
+        yt_video = subparsers.add_parser("youtube-video", help="Download YouTube video (maks 1080p)", parents=[common])
         yt_video.add_argument("--url", required=True, help="YouTube video URL")
         yt_video.add_argument("--format", default="mp4", choices=["mp4", "mp3"], help="format (mp4/mp3)")
 
         # YouTube playlist
-        yt_playlist = subparsers.add_parser("youtube-playlist", help="Donwload YouTube playlist (maks 1080p)")
+        yt_playlist = subparsers.add_parser("youtube-playlist", help="Donwload YouTube playlist (maks 1080p)", parents=[common])
         yt_playlist.add_argument("--url", required=True, help="YouTube playlist URL")
         yt_playlist.add_argument("--format", default="mp4", choices=["mp4", "mp3"], help="format (mp4/mp3)")
+        yt_playlist.add_argument("--jobs", type=int, default=1, help="number of videos downloaded in parallel (default 1)")
+        yt_playlist.add_argument("--resume", action="store_true", help="continue an interrupted run from its checkpoint")
+        yt_playlist.add_argument("--incremental", action="store_true",
+                                 help="list newest entries only, stopping at ones already in the cache (newest-first lists)")
 
         # Instagram bookmarks (cookie-based) - kept for backward compatibility
         # soon...
 
         # Instagram download (URL or file)
-        insta_dl = subparsers.add_parser("instagram-download", help="Download Instagram video (URL or file)")
+        insta_dl = subparsers.add_parser("instagram-download", help="Download Instagram video (URL or file)", parents=[common])
         group = insta_dl.add_mutually_exclusive_group(required=True)
         group.add_argument("--url", help="Instagram video/post/reel URL")
         group.add_argument("--file", help="Text file with Instagram URLs (one per line)")
         insta_dl.add_argument("--format", default="mp4", choices=["mp4","mp3"], help="format (mp4/mp3)")
         insta_dl.add_argument("--out", default="instagram_videos", help="Output folder for Instagram videos")
+        insta_dl.add_argument("--resume", action="store_true", help="with --file: continue an interrupted run from its checkpoint")
 
         # Coub likes
-        coub = subparsers.add_parser("coub-likes", help="Download Coub liked videos")
+        coub = subparsers.add_parser("coub-likes", help="Download Coub liked videos", parents=[common])
         coub.add_argument("--session", required=True, help="_coub_session cookie")
         coub.add_argument("--token", required=True, help="remember_token cookie")
+        coub.add_argument("--jobs", type=int, default=4, help="number of parallel download workers (default 4)")
+        coub.add_argument("--prefetch", type=int, default=2, help="timeline pages buffered ahead of the workers (default 2)")
+        coub.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE // (1024 * 1024), help="read/write chunk size in MiB (default 4)")
+        coub.add_argument("--backend", default="threads", choices=["threads", "async"],
+                          help="download engine: worker threads or one asyncio event loop (needs aiohttp)")
+        coub.add_argument("--per-host", type=int, default=8, help="async backend: concurrent connections per host (default 8)")
+        coub.add_argument("--segments", type=int, default=1,
+                          help="threads backend: split large files into N parallel range requests (default 1 = off)")
+        coub.add_argument("--segment-threshold", type=int, default=DEFAULT_SEGMENT_THRESHOLD // (1024 * 1024),
+                          help="only split files of at least this many MiB (default 16)")
+        coub.add_argument("--resume", action="store_true", help="continue an interrupted run from its checkpoint")
+        coub.add_argument("--incremental", action="store_true", help="stop paging at the first page with only known likes")
+
+        # Mixed batch
+        batch = subparsers.add_parser("batch", help="Download a mixed list of YouTube/Instagram/Coub URLs", parents=[common])
+        batch.add_argument("--file", required=True, help="Text file with URLs of any supported platform (one per line)")
+        batch.add_argument("--format", default="mp4", choices=["mp4", "mp3"], help="format for YouTube/Instagram (mp4/mp3)")
+        batch.add_argument("--limit", action="append", default=[], metavar="PLATFORM=N",
+                           help="concurrent downloads for youtube, instagram or coub (defaults "
+                                + ", ".join(f"{k}={v}" for k, v in BATCH_LIMITS.items()) + "; repeatable)")
+        batch.add_argument("--resume", action="store_true", help="continue an interrupted run from its checkpoint")
+
+        # Daemon
+        daemon = subparsers.add_parser("serve", help="Run as a local daemon with an HTTP job API", parents=[common])
+        daemon.add_argument("--host", default="127.0.0.1", help="address to listen on (default 127.0.0.1)")
+        daemon.add_argument("--port", type=int, default=DEFAULT_SERVE_PORT, help=f"port to listen on (default {DEFAULT_SERVE_PORT})")
+        daemon.add_argument("--format", default="mp4", choices=["mp4", "mp3"], help="format for YouTube/Instagram (mp4/mp3)")
+        daemon.add_argument("--limit", action="append", default=[], metavar="PLATFORM=N",
+                            help="concurrent downloads for youtube, instagram or coub (defaults "
+                                 + ", ".join(f"{k}={v}" for k, v in BATCH_LIMITS.items()) + "; repeatable)")
 
         args = parser.parse_args()
 
+        rates = {}
+        for item in args.rate:
+            key, _, value = item.partition("=")
+            try:
+                rates[key.strip().lower()] = float(value)
+            except ValueError:
+                parser.error(f"--rate expects PLATFORM=REQ_PER_S, got {item!r}")
+        configure_rate_limits(rates, retries=args.retries)
+        configure_transfer_limits(bandwidth=args.bandwidth, min_free=args.min_free)
+        if args.metrics:
+            configure_metrics(args.metrics)
+
+        limits = {}
+        for item in getattr(args, "limit", []):
+            key, _, value = item.partition("=")
+            key = key.strip().lower()
+            if key not in BATCH_LIMITS or not value.strip().isdigit():
+                parser.error(f"--limit expects PLATFORM=N with PLATFORM in {', '.join(BATCH_LIMITS)}, got {item!r}")
+            limits[key] = int(value)
+
+        archive = None if args.no_archive else DownloadArchive(args.archive)
+        cache = None if args.no_cache else ListingCache(args.cache, ttl=args.cache_ttl * 3600)
+        postprocessor = PostProcessQueue(args.ffmpeg_workers)
+
         if args.command == "youtube-video":
-            download_youtube_video(args.url, file_format=args.format)
+            download_youtube_video(args.url, file_format=args.format, archive=archive, postprocessor=postprocessor)
         elif args.command == "youtube-playlist":
-            download_youtube_playlist(args.url, file_format=args.format)
+            download_youtube_playlist(args.url, file_format=args.format, jobs=args.jobs, archive=archive,
+                                      resume=args.resume, cache=cache, incremental=args.incremental,
+                                      postprocessor=postprocessor)
         elif args.command == "instagram-bookmarks":
             download_instagram_bookmarks(args.sessionid, args.ds_user_id, args.csrftoken, user_agent=args.user_agent)
         elif args.command == "instagram-download":
             if args.url:
-                ok = download_instagram_url(args.url, out_folder=args.out, format_preference=args.format)
+                ok = download_instagram_url(args.url, out_folder=args.out, format_preference=args.format, archive=archive,
+                                            postprocessor=postprocessor)
                 if not ok:
                     print("Failed:", args.url)
             else:
-                download_instagram_from_file(args.file, out_folder=args.out, format_preference=args.format)
+                download_instagram_from_file(args.file, out_folder=args.out, format_preference=args.format,
+                                             archive=archive, resume=args.resume, postprocessor=postprocessor)
         elif args.command == "coub-likes":
-            download_coub_likes(args.session, args.token)
+            download_coub_likes(args.session, args.token, jobs=args.jobs, prefetch=args.prefetch,
+                                chunk_size=args.chunk_size * 1024 * 1024, archive=archive,
+                                backend=args.backend, per_host=args.per_host, segments=args.segments,
+                                segment_threshold=args.segment_threshold * 1024 * 1024, resume=args.resume,
+                                cache=cache, incremental=args.incremental)
+        elif args.command == "batch":
+            run_batch(args.file, file_format=args.format, limits=limits, archive=archive, resume=args.resume,
+                      cache=cache, postprocessor=postprocessor)
+        elif args.command == "serve":
+            serve(args.host, args.port, file_format=args.format, limits=limits, archive=archive, cache=cache,
+                  postprocessor=postprocessor)
+
+        postprocessor.close()
+        close_metrics()
+        if archive is not None:
+            archive.close()
+        if cache is not None:
+            cache.close()